@@ -0,0 +1,162 @@
+# blob_store.py
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from .env_config import env_int
+
+try:
+    import xxhash
+except ImportError:  # hashlib fallback, same digest length
+    xxhash = None
+
+
+# Offload oversized event payload strings to the store. Off unless
+# SHEPHERD_BLOB_OFFLOAD=1: clients must fetch bodies from GET /blobs/{digest}
+BLOB_OFFLOAD = os.environ.get("SHEPHERD_BLOB_OFFLOAD", "0").strip() == "1"
+# Event payload strings longer than this many characters are offloaded (and
+# deduplicated across runs)
+BLOB_THRESHOLD = env_int("SHEPHERD_BLOB_THRESHOLD", 16 * 1024)
+# Characters of an offloaded string left inline for display
+BLOB_PREVIEW_CHARS = env_int("SHEPHERD_BLOB_PREVIEW_CHARS", 2000)
+BLOB_DIR = os.environ.get("SHEPHERD_BLOB_DIR", "./backend/logs/blobs")
+
+BLOB_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+
+class BlobStore:
+    """
+    • Content-addressed files for oversized event payload strings
+    • offload() swaps every long string in an event's "data" (at any depth,
+      inside nested dicts and lists too) and its incomplete_tag
+      partial_content for a preview, and records a reference under "blobs"
+      keyed by the string's dotted path:
+          {"tool_output": {"digest": ..., "size": <bytes>, "content_type": ...},
+           "findings.3.code": {...}}
+    • Bodies are keyed by a 128-bit XXH3 digest (BLAKE2b without xxhash), so
+      one copy is shared by every run that emits it; the full body is served
+      by GET /blobs/{digest} (with Range support)
+    • XXH3 is not collision resistant and tool output comes from the analysed
+      repositories, so a hit is only reused after a byte comparison; a
+      colliding body is stored under its SHA-256 instead
+    """
+
+    DIGEST_PATTERN = re.compile(r"[0-9a-f]{32}|[0-9a-f]{64}")
+    # Body fields outside "data"; the rest of the envelope is never touched
+    ENVELOPE_FIELDS = ("partial_content",)
+
+    def __init__(
+        self,
+        root=BLOB_DIR,
+        threshold: int = BLOB_THRESHOLD,
+        preview_chars: int = BLOB_PREVIEW_CHARS,
+    ) -> None:
+        self.root = Path(root)
+        self.threshold = threshold
+        self.preview_chars = min(preview_chars, threshold)
+        self.dedupe_hits = 0
+        self.bytes_stored = 0
+
+    def path(self, digest: str) -> Optional[Path]:
+        """Where a blob lives, or None for a malformed digest"""
+        if not self.DIGEST_PATTERN.fullmatch(digest):
+            return None
+        return self.root / digest[:2] / digest
+
+    @staticmethod
+    def digest(body: bytes) -> str:
+        if xxhash is not None:
+            return xxhash.xxh3_128_hexdigest(body)
+        return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+    def put(self, body: bytes) -> str:
+        """Store body (blocking) and return its digest"""
+        digest = self.digest(body)
+        path = self.path(digest)
+        if path.exists():
+            if self._same(path, body):
+                self.dedupe_hits += 1
+                return digest
+            print(f"[SHEPHERD] Blob digest collision on {digest}, storing under SHA-256")
+            digest = hashlib.sha256(body).hexdigest()
+            path = self.path(digest)
+            if path.exists():
+                return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write-then-rename so a reader never sees a partial blob
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self.bytes_stored += len(body)
+        return digest
+
+    @staticmethod
+    def _same(path: Path, body: bytes) -> bool:
+        if path.stat().st_size != len(body):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == body
+
+    def get(self, digest: str) -> Optional[bytes]:
+        path = self.path(digest)
+        if path is None or not path.exists():
+            return None
+        return path.read_bytes()
+
+    async def offload(self, payload: dict) -> dict:
+        """The payload with oversized strings moved to the store (a copy if anything moved)"""
+        payload = await self._offload_fields(payload, self.ENVELOPE_FIELDS)
+        data = payload.get("data")
+        if isinstance(data, dict):
+            offloaded = await self._offload_fields(data)
+            if offloaded is not data:
+                payload = dict(payload, data=offloaded)
+        return payload
+
+    async def _offload_fields(self, fields: dict, keys=None) -> dict:
+        blobs = {}
+        offloaded = fields
+        for key in (fields if keys is None else keys):
+            if key == "blobs" or key not in fields:
+                continue
+            value = await self._offload_value(fields[key], str(key), blobs)
+            if value is not fields[key]:
+                if offloaded is fields:
+                    offloaded = dict(fields)
+                offloaded[key] = value
+        if blobs:
+            offloaded["blobs"] = dict(fields.get("blobs") or {}, **blobs)
+        return offloaded
+
+    async def _offload_value(self, value, path: str, blobs: dict):
+        """value with long strings offloaded (copies only the containers that change)"""
+        if isinstance(value, str):
+            if len(value) <= self.threshold:
+                return value
+            body = value.encode('utf-8', errors='replace')
+            digest = await asyncio.to_thread(self.put, body)
+            blobs[path] = {"digest": digest, "size": len(body), "content_type": BLOB_CONTENT_TYPE}
+            return value[:self.preview_chars]
+        if isinstance(value, dict):
+            items = value.items()
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            return value
+        copy = None
+        for key, item in items:
+            offloaded = await self._offload_value(item, f"{path}.{key}", blobs)
+            if offloaded is not item:
+                if copy is None:
+                    copy = dict(value) if isinstance(value, dict) else list(value)
+                copy[key] = offloaded
+        return value if copy is None else copy
@@ -0,0 +1,18 @@
+# env_config.py
+import os
+
+
+def env_int(name: str, default: int, minimum: int = 1) -> int:
+    """Read a positive integer setting, falling back to default on bad values"""
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        print(f"[SHEPHERD] Ignoring non-numeric {name}={raw!r}, using {default}")
+        return default
+    if value < minimum:
+        print(f"[SHEPHERD] Ignoring {name}={value} (must be >= {minimum}), using {default}")
+        return default
+    return value
@@ -0,0 +1,167 @@
+# event_queue.py
+import asyncio
+import json
+from collections import deque
+from pathlib import Path
+
+OVERFLOW_POLICIES = ("coalesce", "drop_progress", "spill")
+
+# Events that only preview content the final parsed tag event carries anyway
+PROGRESS_EVENTS = {"stream_delta"}
+
+
+class RunEventQueue:
+    """
+    • Sits between the MAS output parser and WebSocketManager for one run
+    • send_log() never waits on clients: events are queued and a consumer
+      task does the fan-out
+    • When more than capacity events are waiting, overflow_policy decides:
+        coalesce      - stream_delta events are merged into the queued delta
+                        of the same stream (dropped if there is none)
+        drop_progress - incoming progress events are dropped and queued ones
+                        are evicted to make room for other events
+        spill         - events go to a JSONL file and are replayed in order
+      Under coalesce/drop_progress non-progress events (prompts, parsed tags,
+      completion) are never dropped: those that don't fit are spilled like
+      under spill, so memory stays bounded by capacity whatever the policy
+    """
+
+    def __init__(
+        self,
+        ws_manager,
+        run_id: str,
+        capacity: int = 1000,
+        overflow_policy: str = "coalesce",
+        spill_dir: str = "./backend/logs",
+    ) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy must be one of {OVERFLOW_POLICIES}, got {overflow_policy!r}")
+        self.ws_manager = ws_manager
+        self.run_id = run_id
+        self.capacity = max(1, capacity)
+        self.overflow_policy = overflow_policy
+        self.spill_path = Path(spill_dir) / f"{run_id}_events.spill.jsonl"
+        self.dropped = 0
+        self.coalesced = 0
+        self.spilled = 0
+        self._queue: deque = deque()
+        self._spill_writer = None
+        self._spill_reader = None
+        self._spill_pending = 0
+        self._ready = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.create_task(self._consume())
+
+    async def send_log(self, run_id: str, payload: dict) -> None:
+        """Same signature as WebSocketManager.send_log; returns immediately"""
+        self.put(payload)
+
+    def put(self, payload: dict) -> None:
+        if self._closing:
+            raise RuntimeError("RunEventQueue is closed")
+        if self._spill_pending or len(self._queue) >= self.capacity:
+            self._overflow(payload)
+        else:
+            self._queue.append(payload)
+        self._ready.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue) + self._spill_pending
+
+    def _overflow(self, payload: dict) -> None:
+        """Place an event that arrived with the queue full (or events on disk)"""
+        if self.overflow_policy != "spill" and payload.get("type") in PROGRESS_EVENTS:
+            # Merging into a queued delta would jump ahead of spilled events
+            if not self._spill_pending and self.overflow_policy == "coalesce" and self._coalesce(payload):
+                self.coalesced += 1
+            else:
+                self.dropped += 1
+            return
+        if not self._spill_pending and self.overflow_policy == "drop_progress" and self._evict_progress():
+            self._queue.append(payload)
+            return
+        self._spill(payload)
+
+    def _evict_progress(self) -> bool:
+        """Make room for an event that must be delivered by dropping queued progress"""
+        for i, queued in enumerate(self._queue):
+            if queued.get("type") in PROGRESS_EVENTS:
+                del self._queue[i]
+                self.dropped += 1
+                return True
+        return False
+
+    def _coalesce(self, payload: dict) -> bool:
+        for queued in reversed(self._queue):
+            if queued.get("stream_id") != payload.get("stream_id"):
+                continue
+            if queued.get("type") != "stream_delta":
+                # Stream already ended or not yet started in the queue
+                return False
+            queued["data"] = {"content": queued["data"]["content"] + payload["data"]["content"]}
+            return True
+        return False
+
+    def _spill(self, payload: dict) -> None:
+        if self._spill_writer is None:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            self._spill_writer = open(self.spill_path, 'w', encoding='utf-8')
+            self._spill_reader = open(self.spill_path, 'r', encoding='utf-8')
+            print(f"[SHEPHERD] Event queue for {self.run_id} full, spilling to {self.spill_path}")
+        self._spill_writer.write(json.dumps(payload, default=str) + "\n")
+        self._spill_pending += 1
+        self.spilled += 1
+
+    def _unspill(self) -> None:
+        """Move spilled events back into memory once the queue has drained"""
+        self._spill_writer.flush()
+        while self._spill_pending and len(self._queue) < self.capacity:
+            self._queue.append(json.loads(self._spill_reader.readline()))
+            self._spill_pending -= 1
+
+    async def _consume(self) -> None:
+        while True:
+            if not self._queue and self._spill_pending:
+                self._unspill()
+            if not self._queue:
+                if self._closing:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            payload = self._queue.popleft()
+            try:
+                await self.ws_manager.send_log(self.run_id, payload)
+            except Exception as e:
+                print(f"[SHEPHERD] Dropping event for {self.run_id}: {e}")
+
+    async def close(self) -> None:
+        """Deliver everything still queued, then stop the consumer"""
+        if not self._closing:
+            self._closing = True
+            self._ready.set()
+        await asyncio.shield(self._task)
+        self._cleanup()
+
+    def abort(self) -> None:
+        """Stop the consumer without delivering what is left (e.g. on cancellation)"""
+        self._closing = True
+        self._task.cancel()
+        self._cleanup()
+
+    def _cleanup(self) -> None:
+        if self._spill_writer is not None:
+            self._spill_writer.close()
+            self._spill_reader.close()
+            self._spill_writer = None
+            self.spill_path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.pending,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "spilled": self.spilled,
+            "overflow_policy": self.overflow_policy,
+        }
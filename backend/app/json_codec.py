@@ -0,0 +1,55 @@
+# json_codec.py
+import json
+
+try:
+    import orjson
+except ImportError:  # stdlib json only
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError
+
+if orjson is not None:
+    _DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+# orjson parses integers outside the i64/u64 range as floats; 19 digits in a
+# row means such an integer may be present (uint256 amounts in findings), so
+# the text is left to json.loads, which keeps it exact
+_DIGIT_MAP = bytes(0x30 if 0x30 <= i <= 0x39 else 0x20 for i in range(256))
+_LONG_DIGIT_RUN = b"0" * 19
+
+
+def _may_hold_big_int(data) -> bool:
+    if isinstance(data, str):
+        data = data.encode('utf-8', errors='surrogatepass')
+    return _LONG_DIGIT_RUN in bytes(data).translate(_DIGIT_MAP)
+
+
+def loads(data):
+    """
+    • json.loads with orjson's parser when it is installed
+    • Input orjson rejects but json accepts (NaN/Infinity, lone surrogate
+      escapes) and input with 19+ digit runs goes through json.loads, so
+      results and errors are the same either way
+    """
+    if orjson is not None and not _may_hold_big_int(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """
+    • Compact JSON text, as Starlette's send_json produces it
+      (separators=(",", ":"), ensure_ascii=False); orjson may spell some
+      floats differently (0.00005 for 5e-05), never with another value
+    • Values orjson can't encode (e.g. integers beyond 64 bits) fall back to
+      json.dumps; both raise TypeError for unserializable objects
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_DUMPS_OPTIONS).decode()
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
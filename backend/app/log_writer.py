@@ -0,0 +1,181 @@
+# log_writer.py
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+
+class RunLogWriter:
+    """
+    • Appends run output to a log file from a background thread
+    • write() only enqueues, so the event loop never blocks on disk I/O
+    • Pending bytes are written once flush_bytes accumulate or flush_interval
+      passes; close() drains everything and fsyncs the file
+    • While writing, the byte offset of every index_every-th line is recorded;
+      handle() turns that into a RunLogHandle once the log is closed
+    • append=True adds to an existing file (no handle() then)
+    """
+
+    _CLOSE = object()
+
+    def __init__(
+        self,
+        path,
+        flush_bytes: int = 256 * 1024,
+        flush_interval: float = 0.25,
+        index_every: int = 1024,
+        append: bool = False,
+    ) -> None:
+        self.path = Path(path)
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.index_every = max(1, index_every)
+        self.bytes_written = 0
+        self.line_count = 0
+        self.line_offsets: List[int] = [0]
+        self.error: Optional[BaseException] = None
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.append = append
+        self._file = open(self.path, 'ab' if append else 'wb')
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"log-writer:{self.path.name}", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, data: bytes) -> None:
+        if self._closed:
+            raise ValueError("write to closed RunLogWriter")
+        if data and self.error is None:
+            self._queue.put(bytes(data))
+
+    def close(self) -> None:
+        """Flush pending output, fsync and stop the writer thread (idempotent, blocking)"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._CLOSE)
+        self._thread.join()
+
+    def handle(self) -> "RunLogHandle":
+        """Lazy view of the finished log; only valid after close()"""
+        if not self._closed:
+            raise ValueError("RunLogWriter.handle() before close()")
+        if self.append:
+            raise ValueError("RunLogWriter.handle() needs a log written from the start")
+        return RunLogHandle(self.path, self.bytes_written, self.line_count,
+                            self.line_offsets, self.index_every)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self) -> None:
+        pending = bytearray()
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is self._CLOSE:
+                    break
+                if item is not None:
+                    if not pending:
+                        deadline = time.monotonic() + self.flush_interval
+                    pending += item
+                    if len(pending) < self.flush_bytes and time.monotonic() < deadline:
+                        continue
+
+                self._flush(pending)
+                deadline = None
+
+            self._flush(pending)
+            os.fsync(self._file.fileno())
+        except Exception as e:
+            self.error = e
+            print(f"[SHEPHERD] Log writer for {self.path} failed: {e}")
+        finally:
+            self._file.close()
+
+    def _flush(self, pending: bytearray) -> None:
+        if pending:
+            self._file.write(pending)
+            self._file.flush()
+            self._index(pending)
+            self.bytes_written += len(pending)
+            pending.clear()
+
+    def _index(self, data: bytearray) -> None:
+        newlines = data.count(b'\n')
+        # Offset of the line after the n-th newline, for each index point in data
+        n = self.index_every - self.line_count % self.index_every
+        pos = -1
+        seen = 0
+        while n <= newlines:
+            while seen < n:
+                pos = data.index(b'\n', pos + 1)
+                seen += 1
+            self.line_offsets.append(self.bytes_written + pos + 1)
+            n += self.index_every
+        self.line_count += newlines
+
+
+class RunLogHandle:
+    """
+    • Stands in for a finished run's transcript without loading it
+    • size and line_count are known up front; content is read from the log
+      file on demand, by byte range or by line using the sparse offset index
+    • line_offsets[i] is the byte offset of line i * index_every
+    """
+
+    def __init__(self, path, size: int, line_count: int, line_offsets: List[int], index_every: int) -> None:
+        self.path = Path(path)
+        self.size = size
+        self.line_count = line_count
+        self.line_offsets = line_offsets
+        self.index_every = index_every
+
+    def read(self, start: int = 0, length: Optional[int] = None) -> bytes:
+        """Up to length bytes from start (to the end when length is None)"""
+        start = max(0, min(start, self.size))
+        end = self.size if length is None else min(self.size, start + max(0, length))
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def tail(self, n: int) -> bytes:
+        return self.read(max(0, self.size - n))
+
+    def lines(self, start: int = 0, count: Optional[int] = None) -> Iterator[str]:
+        """Decoded lines from line number start, reading only what is needed"""
+        if start < 0:
+            raise ValueError("start must be >= 0")
+        block = min(start // self.index_every, len(self.line_offsets) - 1)
+        skip = start - block * self.index_every
+        with open(self.path, 'rb') as f:
+            f.seek(self.line_offsets[block])
+            remaining = self.size - self.line_offsets[block]
+            while remaining > 0 and count != 0:
+                line = f.readline(remaining)
+                remaining -= len(line)
+                if skip:
+                    skip -= 1
+                    continue
+                if count is not None:
+                    count -= 1
+                yield line.decode('utf-8', errors='ignore')
+
+    def text(self) -> str:
+        """The whole transcript (explicitly loads it all)"""
+        return self.read().decode('utf-8', errors='ignore')
+
+    def __repr__(self) -> str:
+        return f"RunLogHandle({str(self.path)!r}, size={self.size}, lines={self.line_count})"
@@ -2,7 +2,7 @@
 import asyncio
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
 from typing import Dict, Optional, List
 import json
@@ -15,7 +15,10 @@ from pathlib import Path
 from contextlib import asynccontextmanager
 
 from .ws_manager import WebSocketManager
-from .mas_bridge_tags_output import launch_mas_interactive, create_ws_input_handler
+from .blob_store import BLOB_OFFLOAD, BlobStore
+from .mas_bridge_tags_output import MAS_STALL_TIMEOUT, RunProgress, launch_mas_interactive, create_ws_input_handler
+from .parser_pool import shutdown_parser_pool
+from .tool_latency import ToolCallTracer, ToolLatencyStats, ToolTimingArchive
 from .models.db import create_repository_analysis, get_repository_analysis, update_analysis_status, list_user_analyses, delete_repository_analysis
 
 @asynccontextmanager
@@ -44,10 +47,14 @@ async def lifespan(app: FastAPI):
     if run_manager.pid_file.exists():
         run_manager.pid_file.unlink()
     
+    # Stop parser worker processes (MAS_PARSER_MODE=process)
+    shutdown_parser_pool()
+    
     print("👋 Shutdown complete!")
 
 app = FastAPI(lifespan=lifespan)
-ws_manager = WebSocketManager()
+blob_store = BlobStore()
+ws_manager = WebSocketManager(blob_store=blob_store if BLOB_OFFLOAD else None, event_log_dir="./backend/logs")
 
 origins = [
     # "http://localhost:3000",
@@ -68,6 +75,12 @@ app.add_middleware(
 # Store input queues for each run
 input_queues: Dict[str, asyncio.Queue] = {}
 
+# Tool call timings: live tracers of running runs, tables of the last 100
+# finished runs, and per-tool stats aggregated across runs
+tool_tracers: Dict[str, ToolCallTracer] = {}
+tool_timings = ToolTimingArchive(maxsize=100)
+tool_latency = ToolLatencyStats()
+
 # Pydantic Models
 class JobRequest(BaseModel):
     github_url: str
@@ -129,13 +142,15 @@ class RunManager:
                 self.queued_runs.append(queued_run)
                 return {"status": "queued", "run_id": run_id, "queue_position": queue_position}
     
-    async def complete_run(self, run_id: str, success: bool = True):
+    async def complete_run(self, run_id: str, success: bool = True, error: Optional[str] = None):
         """Mark a run as completed and start next queued run if any"""
         async with self._lock:
             if run_id in self.active_runs:
                 run_data = self.active_runs.pop(run_id)
                 run_data["status"] = RunStatus.COMPLETED if success else RunStatus.FAILED
                 run_data["completed_at"] = datetime.utcnow().isoformat()
+                if error:
+                    run_data["error"] = error
                 self.completed_runs[run_id] = run_data
                 
                 # Start next queued run if any
@@ -281,10 +296,13 @@ class RunManager:
             
             # Check completed runs
             if run_id in self.completed_runs:
-                return {
+                status = {
                     "run_id": run_id,
                     "status": self.completed_runs[run_id]["status"]
                 }
+                if "error" in self.completed_runs[run_id]:
+                    status["error"] = self.completed_runs[run_id]["error"]
+                return status
             
             return {"run_id": run_id, "status": "not_found"}
 
@@ -360,9 +378,76 @@ class RunManager:
         except (OSError, ProcessLookupError):
             # Process already dead
             return True
+
+    async def watch_stall(self, run_id: str, progress: RunProgress, run_task: asyncio.Task,
+                          timeout: float, grace: float = 30):
+        """
+        Kill a run's MAS once it has been idle (no output, not waiting for
+        input) for timeout seconds, so its slot goes to the next queued run.
+        If the run still hasn't ended grace seconds after the kill, its task
+        is cancelled.
+        """
+        interval = min(timeout / 4, 30)
+        while not run_task.done():
+            await asyncio.sleep(interval)
+            if progress.pid is None or progress.idle_seconds() < timeout:
+                continue
+            
+            progress.stalled = True
+            print(f"[SHEPHERD] Run {run_id[:8]} made no progress for {timeout:g}s, killing process {progress.pid}")
+            if ws_manager:
+                await ws_manager.send_log(run_id, {
+                    "type": "error",
+                    "data": {"error": f"No output for {timeout:g}s while not waiting for input; run stopped"}
+                })
+            await asyncio.to_thread(self.kill_process, progress.pid)
+            try:
+                await asyncio.wait_for(asyncio.shield(run_task), timeout=grace)
+            except asyncio.TimeoutError:
+                run_task.cancel()
+            except Exception:
+                pass  # the run's own error handling reports it
+            return
+
 # Initialize the run manager
 run_manager = RunManager(max_concurrent=3)
 
+async def launch_watched_run(run_id: str, job_data: dict, input_handler) -> dict:
+    """
+    launch_mas_interactive with the MAS pid registered while it runs, a
+    stall watchdog (MAS_STALL_TIMEOUT) that kills it if it hangs, and tool
+    call timings recorded in tool_tracers / tool_latency
+    """
+    progress = RunProgress(on_process_started=lambda pid: run_manager.register_process(run_id, pid))
+    tool_tracers[run_id] = ToolCallTracer(on_record=tool_latency.add)
+    run_task = asyncio.create_task(launch_mas_interactive(
+        run_id=run_id,
+        job=job_data,
+        input_handler=input_handler,
+        ws_manager=ws_manager,
+        log_dir="./backend/logs",
+        progress=progress,
+        tool_tracer=tool_tracers[run_id]
+    ))
+    watchdog = None
+    if MAS_STALL_TIMEOUT:
+        watchdog = asyncio.create_task(run_manager.watch_stall(run_id, progress, run_task, MAS_STALL_TIMEOUT))
+    try:
+        result = await run_task
+    except asyncio.CancelledError:
+        if not progress.stalled:
+            raise
+        result = {"success": False}
+    finally:
+        if watchdog:
+            watchdog.cancel()
+        run_manager.unregister_process(run_id)
+        tool_timings.put(run_id, tool_tracers.pop(run_id).table())
+    if progress.stalled:
+        result["success"] = False
+        result["error"] = f"stalled: no progress for {MAS_STALL_TIMEOUT}s"
+    return result
+
 # Helper function for starting queued runs
 async def start_queued_run(queued_run: dict):
     """Start a previously queued run"""
@@ -376,21 +461,19 @@ async def start_queued_run(queued_run: dict):
     input_handler = create_ws_input_handler(run_id, input_queues[run_id])
     
     # Start the run
+    error = None
     try:
-        result = await launch_mas_interactive(
-            run_id=run_id,
-            job=job_data,
-            input_handler=input_handler,
-            ws_manager=ws_manager,
-            log_dir="./backend/logs"
-        )
+        result = await launch_watched_run(run_id, job_data, input_handler)
         success = result.get("success", False)
+        error = result.get("error")
     except Exception as e:
         print(f"Error in queued run {run_id}: {e}")
         success = False
+        error = str(e)
     finally:
+        await ws_manager.close_run(run_id)
         # Mark as complete and potentially start next queued run
-        next_run = await run_manager.complete_run(run_id, success)
+        next_run = await run_manager.complete_run(run_id, success, error)
         
         # Clean up input queue
         if run_id in input_queues:
@@ -588,24 +671,19 @@ async def start_run(run_id: str, job: JobRequest, tasks: BackgroundTasks):
         
         # Wrapper to handle completion
         async def run_with_completion():
+            error = None
             try:
-                result = await launch_mas_interactive(
-                    run_id=run_id,
-                    job=job.dict(),
-                    input_handler=input_handler,
-                    ws_manager=ws_manager,
-                    log_dir="./backend/logs"
-                )
-                if 'pid' in result:
-                    run_manager.register_process(run_id, result['pid'])
+                result = await launch_watched_run(run_id, job.dict(), input_handler)
                 success = result.get("success", False)
+                error = result.get("error")
             except Exception as e:
                 print(f"Error in run {run_id}: {e}")
                 success = False
+                error = str(e)
             finally:
-                run_manager.unregister_process(run_id)
+                await ws_manager.close_run(run_id)
                 # Mark as complete and potentially start next queued run
-                next_run = await run_manager.complete_run(run_id, success)
+                next_run = await run_manager.complete_run(run_id, success, error)
                 
                 # Clean up input queue
                 if run_id in input_queues:
@@ -648,6 +726,28 @@ async def get_run_status(run_id: str):
         "queue_position": queue_status.get("queue_position")
     })
 
+@app.get("/runs/{run_id}/tool-timings")
+async def get_tool_timings(run_id: str):
+    """Latency and payload size of every paired tool call/result in a run"""
+    tracer = tool_tracers.get(run_id)
+    table = tracer.table() if tracer else tool_timings.get(run_id)
+    if table is None:
+        raise HTTPException(status_code=404, detail="No tool timings for this run")
+    return {"run_id": run_id, **table}
+
+@app.get("/system/tool-latency")
+async def get_tool_latency():
+    """Per-tool latency and result size histograms across all runs since startup"""
+    return tool_latency.snapshot()
+
+@app.get("/blobs/{digest}")
+async def get_blob(digest: str):
+    """Full body of an offloaded event payload; honours Range: bytes=..."""
+    path = blob_store.path(digest)
+    if path is None or not path.exists():
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return FileResponse(path, media_type="text/plain; charset=utf-8")
+
 # WebSocket Endpoints
 @app.websocket("/ws/{run_id}")
 async def run_logs_ws(ws: WebSocket, run_id: str):
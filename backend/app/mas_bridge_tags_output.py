@@ -1,42 +1,223 @@
 #deployment ver - complete with tag parsing and error handling
 import asyncio
+import codecs
+import hashlib
 import os
+import platform
 import re
+import signal
+import sys
 import json
+import time
+from collections import OrderedDict, deque
+from itertools import islice
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Dict, Any, List, Callable
 from dotenv import load_dotenv
 
+from . import json_codec
+from .env_config import env_int
+from .event_queue import OVERFLOW_POLICIES, RunEventQueue
+from .log_writer import RunLogWriter
+from .parser_pool import get_parser_pool
+from .pty_transport import PTY_AVAILABLE, spawn_pty_process
+
 load_dotenv()
 
 # Configuration for MAS repository
 MAS_REPO_PATH = os.environ.get("MAS_REPO_PATH", "../blackRabbit")
 MAS_PYTHON_PATH = os.environ.get("MAS_PYTHON_PATH", "python")
 
+# Max bytes pulled from the MAS stdout pipe per read (1 = legacy byte-at-a-time)
+MAS_READ_CHUNK_SIZE = env_int("MAS_READ_CHUNK_SIZE", 64 * 1024)
+
+# MAS output that switches the bridge into error state
+RECURSION_LIMIT_SENTINEL = "GRAPH_RECURSION_LIMIT"
+RECURSION_LIMIT_SENTINEL_BYTES = RECURSION_LIMIT_SENTINEL.encode()
+
+# Bytes of recent MAS output kept in memory per run (the full output is in the log file)
+MAS_RECENT_OUTPUT_BYTES = env_int("MAS_RECENT_OUTPUT_BYTES", 64 * 1024)
+
+# Run log is written by a background thread once this many bytes or ms are pending
+MAS_LOG_FLUSH_BYTES = env_int("MAS_LOG_FLUSH_BYTES", 256 * 1024)
+MAS_LOG_FLUSH_MS = env_int("MAS_LOG_FLUSH_MS", 250)
+
+# How MAS output is echoed to the server console:
+#   off     - nothing
+#   line    - whole lines (partial lines are written when output goes idle)
+#   sampled - every MAS_CONSOLE_SAMPLE_EVERY-th line
+#   tagged  - one summary line per completed tag
+CONSOLE_MIRROR_MODES = ("off", "line", "sampled", "tagged")
+MAS_CONSOLE_MIRROR = os.environ.get("MAS_CONSOLE_MIRROR", "line").strip().lower()
+if MAS_CONSOLE_MIRROR not in CONSOLE_MIRROR_MODES:
+    print(f"[SHEPHERD] Ignoring MAS_CONSOLE_MIRROR={MAS_CONSOLE_MIRROR!r}, using 'line'")
+    MAS_CONSOLE_MIRROR = "line"
+MAS_CONSOLE_SAMPLE_EVERY = env_int("MAS_CONSOLE_SAMPLE_EVERY", 100)
+
+# While a tag is open its content goes out as stream_delta events once this
+# many characters or ms have accumulated
+MAS_STREAM_DELTA_CHARS = env_int("MAS_STREAM_DELTA_CHARS", 4096)
+MAS_STREAM_DELTA_MS = env_int("MAS_STREAM_DELTA_MS", 100)
+
+# Per-run queue between the output parser and the WebSocket fan-out
+# (see RunEventQueue for the overflow policies)
+MAS_EVENT_QUEUE_SIZE = env_int("MAS_EVENT_QUEUE_SIZE", 1000)
+MAS_EVENT_QUEUE_POLICY = os.environ.get("MAS_EVENT_QUEUE_POLICY", "coalesce").strip().lower()
+if MAS_EVENT_QUEUE_POLICY not in OVERFLOW_POLICIES:
+    print(f"[SHEPHERD] Ignoring MAS_EVENT_QUEUE_POLICY={MAS_EVENT_QUEUE_POLICY!r}, using 'coalesce'")
+    MAS_EVENT_QUEUE_POLICY = "coalesce"
+
+# Where run output is parsed: "inline" on the event loop, or "process" in a
+# pool of MAS_PARSER_WORKERS worker processes shared by all runs
+PARSER_MODES = ("inline", "process")
+MAS_PARSER_MODE = os.environ.get("MAS_PARSER_MODE", "inline").strip().lower()
+if MAS_PARSER_MODE not in PARSER_MODES:
+    print(f"[SHEPHERD] Ignoring MAS_PARSER_MODE={MAS_PARSER_MODE!r}, using 'inline'")
+    MAS_PARSER_MODE = "inline"
+MAS_PARSER_WORKERS = env_int("MAS_PARSER_WORKERS", os.cpu_count() or 1)
+
+# Ask the kernel whether the MAS is blocked reading stdin (Linux /proc) instead
+# of guessing from output silence; idle ticks then come every MAS_INPUT_PROBE_MS
+MAS_INPUT_PROBE = os.environ.get("MAS_INPUT_PROBE", "1").strip() != "0"
+MAS_INPUT_PROBE_MS = env_int("MAS_INPUT_PROBE_MS", 20)
+
+# How the MAS child is attached: "pipe", or "pty" so it sees a terminal and
+# line-buffers its output
+TRANSPORTS = ("pipe", "pty")
+MAS_TRANSPORT = os.environ.get("MAS_TRANSPORT", "pipe").strip().lower()
+if MAS_TRANSPORT not in TRANSPORTS:
+    print(f"[SHEPHERD] Ignoring MAS_TRANSPORT={MAS_TRANSPORT!r}, using 'pipe'")
+    MAS_TRANSPORT = "pipe"
+
+# Top-level JSON fields of a tag body sent as stream_field events as soon as
+# they are complete, before the rest of the tag arrives ("" turns this off)
+MAS_STREAM_FIELDS = tuple(
+    field.strip() for field in os.environ.get("MAS_STREAM_FIELDS", "tool,tool_name,args,status").split(",")
+    if field.strip()
+)
+
+# Per-run prompt detection state: lines of recent output kept for context,
+# and answered prompts remembered (least recently seen are forgotten first)
+MAS_PROMPT_HISTORY = env_int("MAS_PROMPT_HISTORY", 10, minimum=5)
+MAS_SEEN_PROMPTS = env_int("MAS_SEEN_PROMPTS", 256)
+
+# The MAS speaks the structured event pipe (see EventChannel); only turn this
+# on for a MAS that does, since stdout tags are then ignored
+MAS_EVENT_CHANNEL = os.environ.get("MAS_EVENT_CHANNEL", "0").strip() == "1"
+
+# An agent loop is this many consecutive EXECUTOR_TOOL_CALLs with the same tool
+# and arguments; "alert" tells the client, "terminate" also stops the MAS
+TOOL_LOOP_ACTIONS = ("off", "alert", "terminate")
+MAS_TOOL_LOOP_REPEATS = env_int("MAS_TOOL_LOOP_REPEATS", 5, minimum=2)
+MAS_TOOL_LOOP_ACTION = os.environ.get("MAS_TOOL_LOOP_ACTION", "alert").strip().lower()
+if MAS_TOOL_LOOP_ACTION not in TOOL_LOOP_ACTIONS:
+    print(f"[SHEPHERD] Ignoring MAS_TOOL_LOOP_ACTION={MAS_TOOL_LOOP_ACTION!r}, using 'alert'")
+    MAS_TOOL_LOOP_ACTION = "alert"
+# Seconds a MAS terminated for looping gets to exit before it is SIGKILLed
+MAS_TOOL_LOOP_KILL_GRACE = env_int("MAS_TOOL_LOOP_KILL_GRACE", 5)
+
+# Seconds a run may go without output while not waiting for input before the
+# stall watchdog kills it and frees its slot (0 turns the watchdog off)
+MAS_STALL_TIMEOUT = env_int("MAS_STALL_TIMEOUT", 900, minimum=0)
+
+# Compiled literal searches beat str.find for these runs of '<'
+_MARKER_PREFIXES = {prefix: re.compile(re.escape(prefix)) for prefix in ('<<<', '<<<END_')}
+
+def _find_marker(text: str, prefix: str, start: int):
+    """(start, end) of the first prefix + [^>]+ + ">>>" at or after start, else None
+    
+    Every candidate before a '>' ends at that '>', so a failed candidate is
+    skipped past it and the scan stays linear
+    """
+    search = _MARKER_PREFIXES[prefix].search
+    pos = start
+    while True:
+        match = search(text, pos)
+        if match is None:
+            return None
+        i, body = match.span()
+        close = text.find('>', body)
+        if close == -1:
+            return None
+        if close > body and text.startswith('>>>', close):
+            return i, close + 3
+        pos = close + 1
+
+def _strip_markers(text: str, prefix: str, pairs: bool = False) -> str:
+    """Remove every prefix + [^>]+ + ">>>" marker left to right; with pairs,
+    remove from each marker through the next <<<END_...>>> instead, and stop
+    at the first marker without one (no later marker can have one either)"""
+    parts = []
+    copied = pos = 0
+    while True:
+        marker = _find_marker(text, prefix, pos)
+        if marker is None:
+            break
+        start, end = marker
+        if pairs:
+            closing = _find_marker(text, '<<<END_', end)
+            if closing is None:
+                break
+            end = closing[1]
+        parts.append(text[copied:start])
+        copied = pos = end
+    if not parts:
+        return text
+    parts.append(text[copied:])
+    return "".join(parts)
+
 def clean_all_tags(text):
-    """Remove ALL tags in <<<TAG>>> format from any text"""
+    """Remove ALL tags in <<<TAG>>> format from any text
+    
+    Same result as the five regex passes this replaced, but each pass is a
+    linear scan for the next marker (no DOTALL .*? backtracking on large bodies)
+    """
     if not text:
         return text
     
-    # Pattern to match ANY tag: <<<ANYTHING>>> ... <<<END_ANYTHING>>>
-    # This will match nested tags, partial tags, any tag format
     cleaned = text
+    # Without any <<< only the incomplete closing tag check can apply
+    if _MARKER_PREFIXES['<<<'].search(text):
+        # Remove complete tag pairs: <<<TAG>>>content<<<END_TAG>>>
+        cleaned = _strip_markers(cleaned, '<<<', pairs=True)
+        
+        # Remove any standalone opening tags: <<<TAG>>>
+        cleaned = _strip_markers(cleaned, '<<<')
+        
+        # Remove any standalone closing tags: <<<END_TAG>>>
+        cleaned = _strip_markers(cleaned, '<<<END_')
+        
+        # Remove an incomplete opening tag at the end: <<< with no '>' after it
+        partial = cleaned.find('<<<', cleaned.rfind('>') + 1)
+        if partial != -1:
+            cleaned = cleaned[:partial]
     
-    # Remove complete tag pairs: <<<TAG>>>content<<<END_TAG>>>
-    cleaned = re.sub(r'<<<[^>]+>>>.*?<<<END_[^>]+>>>', '', cleaned, flags=re.DOTALL)
+    # Remove an incomplete closing tag at the start: the last >>> before any '<'
+    first_lt = cleaned.find('<')
+    partial = cleaned.rfind('>>>', 0, len(cleaned) if first_lt == -1 else first_lt)
+    if partial != -1:
+        cleaned = cleaned[partial + 3:]
     
-    # Remove any standalone opening tags: <<<TAG>>>
-    cleaned = re.sub(r'<<<[^>]+>>>', '', cleaned)
+    return cleaned.strip()
+
+class OutputDecoder:
+    """Incremental UTF-8 decoder for MAS output chunks
     
-    # Remove any standalone closing tags: <<<END_TAG>>>
-    cleaned = re.sub(r'<<<END_[^>]+>>>', '', cleaned)
+    Keeps the tail of a multi-byte codepoint that was split across two reads
+    and prepends it to the next chunk instead of dropping it
+    """
     
-    # Remove any partial tags that might be cut off: <<<... or ...>>>
-    cleaned = re.sub(r'<<<[^>]*$', '', cleaned)  # Remove incomplete opening tags at end
-    cleaned = re.sub(r'^[^<]*>>>', '', cleaned)  # Remove incomplete closing tags at start
+    def __init__(self, errors: str = 'ignore'):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors=errors)
     
-    return cleaned.strip()
+    def decode(self, data: bytes) -> str:
+        """Decode a chunk, holding back any incomplete trailing sequence"""
+        return self._decoder.decode(data)
+    
+    def flush(self) -> str:
+        """Decode whatever is still held back (end of stream)"""
+        return self._decoder.decode(b'', final=True)
 
 class TagParser:
     """Parser for MAS structured output tags"""
@@ -138,7 +319,7 @@ class TagParser:
             
             if content.startswith('{') and content.endswith('}'):
                 # Now parse the already-cleaned JSON
-                data = json.loads(content)
+                data = json_codec.loads(content)
             else:
                 data = {"content": content}
             
@@ -147,7 +328,7 @@ class TagParser:
                 "data": data,
                 "tag_type": tag_type
             }
-        except json.JSONDecodeError:
+        except json_codec.JSONDecodeError:
             return {
                 "type": tag_type.lower().replace('_', '-'),
                 "data": {"content": content},
@@ -166,12 +347,140 @@ class TagParser:
             }
         return None
 
+class TagScanner:
+    """Single-pass scanner for <<<TAG>>> / <<<END_TAG>>> markers
+    
+    Every '<<<' is located with find() and the marker name is resolved with
+    one dict lookup, so a chunk is scanned in O(len) no matter how many tag
+    types exist. A marker split across chunks is held back until it completes.
+    
+    With binary=True the scanner works on the raw pipe bytes (the delimiters
+    are pure ASCII) and hands out memoryview slices, so nothing is decoded or
+    copied until a consumer asks for it.
+    
+    feed() returns (event, tag_type, payload) tuples where event is 'text'
+    (outside tags), 'start', 'content' or 'end'. Like the character-based
+    buffer it replaces, a start marker always opens a new tag (even inside
+    another one) and only the end marker of the open tag closes it.
+    """
+    
+    OPEN = '<<<'
+    CLOSE = '>>>'
+    
+    def __init__(self, tag_names=None, binary: bool = False):
+        tag_names = list(tag_names or TagParser.TAG_PATTERNS.keys())
+        encode = (lambda value: value.encode('ascii')) if binary else (lambda value: value)
+        self.binary = binary
+        self.open = encode(self.OPEN)
+        self.close = encode(self.CLOSE)
+        self.empty = encode("")
+        self.start_markers = {encode(name): name for name in tag_names}
+        self.end_markers = {encode(f'END_{name}'): name for name in tag_names}
+        self.max_name_len = max(len(name) for name in self.end_markers)
+        self.max_marker_len = self.max_name_len + len(self.OPEN) + len(self.CLOSE)
+        self.current_tag = None
+        self.pending = self.empty
+    
+    def feed(self, data) -> List[tuple]:
+        """Scan a chunk (str, or bytes in binary mode) and return the events it completes"""
+        if self.pending:
+            data = self.pending + data
+        self.pending = self.empty
+        view = memoryview(data) if self.binary else data
+        events = []
+        size = len(data)
+        emitted = 0
+        pos = 0
+        
+        while True:
+            start = data.find(self.open, pos)
+            if start == -1:
+                # Hold back a trailing '<' or '<<' that may begin a marker
+                keep = size
+                while keep > emitted and size - keep < len(self.OPEN) - 1 and data[keep - 1:keep] == self.open[:1]:
+                    keep -= 1
+                break
+            
+            name_start = start + len(self.OPEN)
+            end = data.find(self.close, name_start, name_start + self.max_name_len + len(self.CLOSE))
+            if end == -1:
+                if size - start < self.max_marker_len:
+                    # Possibly a marker cut off by the end of the chunk
+                    keep = start
+                    break
+                pos = start + 1
+                continue
+            
+            name = data[name_start:end]
+            if name in self.start_markers:
+                event = ('start', self.start_markers[name], None)
+            elif self.current_tag and self.end_markers.get(name) == self.current_tag:
+                event = ('end', self.current_tag, None)
+            else:
+                pos = start + 1
+                continue
+            
+            if start > emitted:
+                events.append(self._region(view[emitted:start]))
+            events.append(event)
+            self.current_tag = event[1] if event[0] == 'start' else None
+            emitted = pos = end + len(self.CLOSE)
+        
+        if keep > emitted:
+            events.append(self._region(view[emitted:keep]))
+        self.pending = data[keep:]
+        return events
+    
+    def flush(self) -> List[tuple]:
+        """Release any held-back text (end of stream)"""
+        if not self.pending:
+            return []
+        events = [self._region(self.pending)]
+        self.pending = self.empty
+        return events
+    
+    def _region(self, payload):
+        if self.current_tag:
+            return ('content', self.current_tag, payload)
+        return ('text', None, payload)
+
+class BoundedSet:
+    """Set with a size limit that forgets the least recently added/checked member
+    
+    add, membership test and eviction are O(1) (OrderedDict underneath)
+    """
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = max(1, maxsize)
+        self._items: "OrderedDict[Any, None]" = OrderedDict()
+    
+    def add(self, item):
+        self._items[item] = None
+        self._items.move_to_end(item)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+    
+    def __contains__(self, item) -> bool:
+        if item in self._items:
+            self._items.move_to_end(item)
+            return True
+        return False
+    
+    def clear(self):
+        self._items.clear()
+    
+    def __len__(self) -> int:
+        return len(self._items)
+    
+    def __iter__(self):
+        return iter(self._items)
+
 class PromptDetector:
     """Legacy prompt detector for fallback cases"""
-    def __init__(self):
-        self.recent_lines = []
-        self.max_history = 10
-        self.seen_prompts = set()
+    def __init__(self, max_history: int = MAS_PROMPT_HISTORY, max_seen: int = MAS_SEEN_PROMPTS):
+        self.max_history = max_history
+        self.recent_lines = deque(maxlen=max_history)
+        self.seen_prompts = BoundedSet(max_seen)
         self.last_input_time = 0
         self.waiting_for_multiline = False
         self.multiline_empty_count = 0
@@ -179,121 +488,98 @@ class PromptDetector:
     def add_line(self, line: str):
         """Add a line to history"""
         self.recent_lines.append(line)
-        if len(self.recent_lines) > self.max_history:
-            self.recent_lines.pop(0)
     
-    def is_progress_output(self, line: str) -> bool:
-        """Check if this looks like progress/status output"""
-        line_lower = line.lower().strip()
-        
-        # Common progress indicators
-        progress_patterns = [
-            r'\d+%',  # Percentage
-            r'\[\d+/\d+\]',  # [1/10] style progress
-            r'\(\d+/\d+\)',  # (1/10) style progress
-            r'\.{3,}',  # Multiple dots ...
-            r'\s{2,}\d+\s{2,}',  # Spaced numbers
-            r'^\s*\*+\s*$',  # Lines of asterisks
-            r'^\s*-+\s*$',  # Lines of dashes
-            r'^\s*=+\s*$',  # Lines of equals
-        ]
-        
-        # Check regex patterns
-        for pattern in progress_patterns:
-            if re.search(pattern, line):
-                return True
-        
-        # Check for specific keywords that indicate progress
-        progress_keywords = [
-            'remote:', 'counting', 'compressing', 'receiving', 'resolving',
-            'unpacking', 'checking', 'updating', 'downloading', 'uploading',
-            'processing', 'installing', 'building', 'compiled', 'linking',
-            'bytes', 'objects', 'deltas', 'done', 'complete', 'finished',
-            'progress', 'status', 'info:', 'debug:', 'trace:', 'warn:',
-            'writing', 'reading', 'loading', 'saving', 'fetching'
-        ]
-        
-        for keyword in progress_keywords:
-            if keyword in line_lower:
-                return True
-        
-        return False
+    def last_lines(self, n: int) -> List[str]:
+        """The n most recent lines, oldest first"""
+        return list(islice(self.recent_lines, max(0, len(self.recent_lines) - n), None))
     
-    def is_likely_prompt(self, line: str) -> bool:
-        """Check if this line is likely a prompt for user input"""
-        if not line or len(line) > 300:
-            return False
-        
-        line_lower = line.lower().strip()
-        # if "run another mas?" in line_lower:
-        #     return True
-        if "press enter twice" in line_lower:
-            return False
-        
-        line_stripped = line.strip()
-        if not line_stripped:
-            return False
-        
-        # First, exclude progress output
-        if self.is_progress_output(line):
-            return False
-        
-        # Check if it's a repeat of a prompt we've already answered
-        if line_stripped in self.seen_prompts:
-            return False
-        
-        # Look for specific MAS prompts
-        mas_prompt_patterns = [
+    # Progress indicators and progress keywords in one pass over line.lower()
+    # (lowercasing only touches letters, which the indicator patterns never match)
+    PROGRESS_PATTERN = re.compile("|".join([
+        r'\d+%',  # Percentage
+        r'\[\d+/\d+\]',  # [1/10] style progress
+        r'\(\d+/\d+\)',  # (1/10) style progress
+        r'\.{3,}',  # Multiple dots ...
+        r'\s{2,}\d+\s{2,}',  # Spaced numbers
+        r'^\s*\*+\s*$',  # Lines of asterisks
+        r'^\s*-+\s*$',  # Lines of dashes
+        r'^\s*=+\s*$',  # Lines of equals
+    ] + [re.escape(keyword) for keyword in (
+        'remote:', 'counting', 'compressing', 'receiving', 'resolving',
+        'unpacking', 'checking', 'updating', 'downloading', 'uploading',
+        'processing', 'installing', 'building', 'compiled', 'linking',
+        'bytes', 'objects', 'deltas', 'done', 'complete', 'finished',
+        'progress', 'status', 'info:', 'debug:', 'trace:', 'warn:',
+        'writing', 'reading', 'loading', 'saving', 'fetching'
+    )]))
+    
+    # MAS-specific prompts (anywhere in the line) before general question
+    # shapes (at the start). A question match can only shadow a MAS match on
+    # lines like "Step 1:", which no MAS pattern matches
+    PROMPT_PATTERN = re.compile(
+        r'(?P<mas>' + "|".join([
             r'Enter the contract name.*:$',
             r'Enter the specific function.*:$',
             r'Enter hypothesis.*:$',
             r'Enter your detailed vulnerability hypothesis.*:$',
-            r'â–¶ï¸\s*Run another MAS\?.*:$', 
-            r'Run another MAS\?.*:$',  
-            r'\(y/N\):?\s*$',  
-        ]
-        
-        # Check MAS-specific patterns first
-        for pattern in mas_prompt_patterns:
-            if re.search(pattern, line_stripped, re.IGNORECASE):
-                return True
-        
-        # Look for general question patterns
-        question_patterns = [
-            r'^.*\?\s*$',  # Ends with ?
-            r'^.*:\s*$',   # Ends with :
-            r'^>\s*',      # Starts with >
-            r'^>>>\s*',    # Python-style prompt
-            r'^\$\s*',     # Shell prompt
-            r'^Enter\s+',  # Starts with Enter
-            r'^Please\s+', # Starts with Please
-            r'^Provide\s+', # Starts with Provide
-            r'^Select\s+', # Starts with Select
-            r'^Choose\s+', # Starts with Choose
-            r'^Type\s+',   # Starts with Type
-            r'^Input\s+',  # Starts with Input
-            r'^What\s+',   # Starts with What
-            r'^Which\s+',  # Starts with Which
-            r'^Do you\s+', # Starts with Do you
-            r'^Would you\s+', # Starts with Would you
-            r'^Specify\s+', # Starts with Specify
-        ]
+            r'â–¶ï¸\s*Run another MAS\?.*:$',
+            r'Run another MAS\?.*:$',
+            r'\(y/N\):?\s*$',
+        ]) + r')|\A(?P<question>' + "|".join([
+            r'.*\?\s*$',  # Ends with ?
+            r'.*:\s*$',   # Ends with :
+            r'>\s*',      # Starts with >
+            r'>>>\s*',    # Python-style prompt
+            r'\$\s*',     # Shell prompt
+            r'Enter\s+',  # Starts with Enter
+            r'Please\s+', # Starts with Please
+            r'Provide\s+', # Starts with Provide
+            r'Select\s+', # Starts with Select
+            r'Choose\s+', # Starts with Choose
+            r'Type\s+',   # Starts with Type
+            r'Input\s+',  # Starts with Input
+            r'What\s+',   # Starts with What
+            r'Which\s+',  # Starts with Which
+            r'Do you\s+', # Starts with Do you
+            r'Would you\s+', # Starts with Would you
+            r'Specify\s+', # Starts with Specify
+        ]) + r')',
+        re.IGNORECASE,
+    )
+    
+    # "Step 1:" or "100%:" are labels, not prompts
+    LABEL_PATTERN = re.compile(r'(Step\s+)?\d+$|\d+%$')
+    
+    def classify(self, line: str) -> str:
+        """"prompt", "progress" or "plain" for one line of output"""
+        if not line:
+            return "plain"
+        line_lower = line.lower()
+        if self.PROGRESS_PATTERN.search(line_lower):
+            return "progress"
+        if len(line) > 300 or "press enter twice" in line_lower:
+            return "plain"
         
-        # Check patterns
-        for pattern in question_patterns:
-            if re.match(pattern, line_stripped, re.IGNORECASE):
-                # Additional validation
-                if line_stripped.endswith(':'):
-                    text_before = line_stripped[:-1].strip()
-                    # Avoid matching "Step 1:" or "100%:" etc
-                    if re.match(r'^(Step\s+)?\d+$', text_before) or re.match(r'^\d+%$', text_before):
-                        return False
-                    # But DO match prompts with parentheses
-                    if "enter" in text_before.lower() or "input" in text_before.lower():
-                        return True
-                return True
+        line_stripped = line.strip()
+        # Empty, or a repeat of a prompt we've already answered
+        if not line_stripped or line_stripped in self.seen_prompts:
+            return "plain"
         
-        return False
+        match = self.PROMPT_PATTERN.search(line_stripped)
+        if match is None:
+            return "plain"
+        if match.lastgroup == "question" and line_stripped.endswith(':'):
+            if self.LABEL_PATTERN.match(line_stripped[:-1].strip()):
+                return "plain"
+        return "prompt"
+    
+    def is_progress_output(self, line: str) -> bool:
+        """Check if this looks like progress/status output"""
+        return self.PROGRESS_PATTERN.search(line.lower()) is not None
+    
+    def is_likely_prompt(self, line: str) -> bool:
+        """Check if this line is likely a prompt for user input"""
+        return self.classify(line) == "prompt"
     
     def should_wait_for_input(self, current_line: str, time_since_last_char: float) -> bool:
         """Determine if we should wait for user input"""
@@ -310,7 +596,7 @@ class PromptDetector:
         
         has_setup_context = any(
             any(indicator in line for indicator in setup_indicators) 
-            for line in self.recent_lines[-5:]
+            for line in self.last_lines(5)
         )
         
         # Special case: Check for hypothesis instructions
@@ -321,7 +607,7 @@ class PromptDetector:
         ]
         
         # Check if we just saw hypothesis instructions
-        for line in self.recent_lines[-3:]:
+        for line in self.last_lines(3):
             for indicator in hypothesis_indicators:
                 if indicator in line:
                     return True
@@ -333,7 +619,7 @@ class PromptDetector:
                 
             # Otherwise use normal detection
             if len(self.recent_lines) >= 2:
-                recent_progress_count = sum(1 for line in self.recent_lines[-3:] 
+                recent_progress_count = sum(1 for line in self.last_lines(3)
                                           if self.is_progress_output(line))
                 if recent_progress_count >= 2:
                     return False
@@ -341,26 +627,283 @@ class PromptDetector:
         
         return False
 
+class StdinWaitProbe:
+    """Tells whether a child process is blocked reading its stdin
+    
+    Looks at /proc/<pid>/task/*/syscall of the child and its descendants
+    (wrappers like `conda run` or `poetry run` read stdin in a grandchild): a
+    thread sleeping (non-zero wchan) in a read-family syscall on fd 0 is
+    waiting for input. waiting_for_input() returns None where that cannot be
+    known (non-Linux, unknown architecture, no permission) and until such a
+    read has been seen once, since a process that waits in select/poll never
+    shows one; callers then fall back to the output heuristics.
+    """
+    
+    # read, pread64, readv, preadv
+    READ_SYSCALLS = {
+        "x86_64": {0, 17, 19, 295},
+        "aarch64": {63, 65, 67, 69},
+    }
+    # Without /proc/<pid>/task/<tid>/children the tree comes from a /proc scan
+    PROC_SCAN_SECONDS = 1.0
+    
+    def __init__(self, pid: int, fd: int = 0):
+        self.pid = pid
+        self.fd = fd
+        self.read_syscalls = self.READ_SYSCALLS.get(platform.machine())
+        self.available = self.read_syscalls is not None and os.path.exists(f"/proc/{pid}/syscall")
+        self.seen_read = False
+        self._scanned_at = 0.0
+        self._scanned: List[int] = []
+    
+    def waiting_for_input(self) -> Optional[bool]:
+        if not self.available:
+            return None
+        if not os.path.isdir(f"/proc/{self.pid}/task"):
+            return False  # process is gone
+        try:
+            for pid in self._process_tree():
+                if self._reading(pid):
+                    self.seen_read = True
+                    return True
+        except PermissionError:
+            self.available = False
+            return None
+        return False if self.seen_read else None
+    
+    def _reading(self, pid: int) -> bool:
+        task_dir = f"/proc/{pid}/task"
+        try:
+            tids = os.listdir(task_dir)
+        except FileNotFoundError:
+            return False
+        for tid in tids:
+            try:
+                with open(f"{task_dir}/{tid}/syscall") as f:
+                    fields = f.read().split()
+                if len(fields) < 2 or fields[0] in ("running", "-1"):
+                    continue
+                if int(fields[0]) not in self.read_syscalls or int(fields[1], 16) != self.fd:
+                    continue
+                with open(f"{task_dir}/{tid}/wchan") as f:
+                    if f.read().strip() not in ("", "0"):
+                        return True
+            except PermissionError:
+                raise
+            except (OSError, ValueError):
+                continue  # thread exited between listdir and open
+        return False
+    
+    def _process_tree(self) -> List[int]:
+        """The child first, then its descendants"""
+        tree = [self.pid]
+        i = 0
+        while i < len(tree):
+            children = self._children(tree[i])
+            if children is None:
+                return [self.pid] + self._scan_descendants()
+            tree.extend(children)
+            i += 1
+        return tree
+    
+    def _children(self, pid: int) -> Optional[List[int]]:
+        task_dir = f"/proc/{pid}/task"
+        children: List[int] = []
+        try:
+            tids = os.listdir(task_dir)
+        except FileNotFoundError:
+            return children
+        for tid in tids:
+            try:
+                with open(f"{task_dir}/{tid}/children") as f:
+                    children.extend(int(child) for child in f.read().split())
+            except FileNotFoundError:
+                if not os.path.isdir(f"{task_dir}/{tid}"):
+                    continue  # thread exited
+                return None  # kernel without CONFIG_PROC_CHILDREN
+        return children
+    
+    def _scan_descendants(self) -> List[int]:
+        now = time.monotonic()
+        if now - self._scanned_at < self.PROC_SCAN_SECONDS:
+            return self._scanned
+        self._scanned_at = now
+        kids: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    stat = f.read()
+                ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            kids.setdefault(ppid, []).append(int(entry))
+        tree = [self.pid]
+        i = 0
+        while i < len(tree):
+            tree.extend(kids.get(tree[i], ()))
+            i += 1
+        self._scanned = tree[1:]
+        return self._scanned
+
+class JsonFieldStream:
+    """Picks complete top-level fields out of a JSON object while it streams in
+    
+    Only string/escape state and nesting depth are tracked, with regex jumps
+    between the characters that matter, so large values are skipped without
+    being decoded or kept. Values of the watched fields are json.loads-ed
+    once they end. A body that is not a JSON object stops the scan.
+    """
+    
+    _STRUCTURE = re.compile(r'["{}\[\],:]')
+    _STRING = re.compile(r'["\\]')
+    
+    def __init__(self, fields):
+        self.fields = set(fields)
+        self.depth = 0
+        self.started = False
+        self.done = False
+        self.in_string = False
+        self.escaped = False
+        # At depth 1: expecting a "key", a "colon" or inside a "value"
+        self.state = "key"
+        self.key = None
+        self.key_parts: Optional[List[str]] = None
+        self.value_parts: Optional[List[str]] = None
+    
+    def feed(self, text: str) -> List[tuple]:
+        """Consume the next piece of the body; returns (field, value) pairs completed in it"""
+        found = []
+        if self.done:
+            return found
+        pos = 0
+        if not self.started:
+            stripped = text.lstrip()
+            if not stripped:
+                return found
+            if stripped[0] != '{':
+                self.done = True
+                return found
+            self.started = True
+            self.depth = 1
+            pos = len(text) - len(stripped) + 1
+        key_from = value_from = pos
+        
+        while pos < len(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                    pos += 1
+                    continue
+                m = self._STRING.search(text, pos)
+                if m is None:
+                    break
+                pos = m.end()
+                if m.group() == '\\':
+                    self.escaped = True
+                    continue
+                self.in_string = False
+                if self.key_parts is not None:
+                    self.key_parts.append(text[key_from:pos - 1])
+                    self.key = self._decode_key("".join(self.key_parts))
+                    self.key_parts = None
+                    self.state = "colon"
+                continue
+            
+            m = self._STRUCTURE.search(text, pos)
+            if m is None:
+                break
+            char = m.group()
+            pos = m.end()
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.state == "key":
+                    self.key_parts = []
+                    key_from = pos
+            elif char in '{[':
+                self.depth += 1
+            elif self.depth > 1:
+                if char in '}]':
+                    self.depth -= 1
+            elif char == ':' and self.state == "colon":
+                self.state = "value"
+                if self.key in self.fields:
+                    self.value_parts = []
+                    value_from = pos
+            elif char in ',}' and self.state == "value":
+                if self.value_parts is not None:
+                    self.value_parts.append(text[value_from:pos - 1])
+                    try:
+                        found.append((self.key, json_codec.loads("".join(self.value_parts))))
+                        self.fields.discard(self.key)
+                    except json_codec.JSONDecodeError:
+                        pass
+                    self.value_parts = None
+                self.state = "key"
+                if char == '}':
+                    self.done = True
+                    return found
+            elif char in '}]':
+                self.done = True
+                return found
+        
+        # Carry the unfinished key or value over to the next piece
+        if self.key_parts is not None:
+            self.key_parts.append(text[key_from:])
+        if self.value_parts is not None:
+            self.value_parts.append(text[value_from:])
+        return found
+    
+    def _decode_key(self, raw: str) -> Optional[str]:
+        try:
+            return json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            return None
+
 class TagAwareOutputBuffer:
-    """Buffer that ONLY streams tagged content, ignoring regular output"""
+    """Buffer that ONLY streams tagged content, ignoring regular output
+    
+    With binary=True add_chunk() takes raw pipe bytes and only tag bodies are
+    decoded. Untagged output is skipped here; OutputLineTracker follows it for
+    prompts
+    
+    The parsing core (feed, take_delta, finish) is synchronous and returns the
+    events to send, so it can also run away from the event loop (see
+    ProcessOutputBuffer); the async methods send those events to ws_manager
+    """
     
-    def __init__(self, ws_manager, run_id):
+    def __init__(self, ws_manager, run_id, binary: bool = False,
+                 delta_chars: int = MAS_STREAM_DELTA_CHARS, delta_ms: int = MAS_STREAM_DELTA_MS,
+                 stream_fields=MAS_STREAM_FIELDS):
         self.ws_manager = ws_manager
         self.run_id = run_id
         self.parser = TagParser()
+        self.scanner = TagScanner(binary=binary)
+        self.content_decoder = OutputDecoder()
         self.prompt_detector = PromptDetector()
-        self.buffer = ""
-        self.hold_buffer = ""
         self.error_state = False
-        self.seen_prompts = set()
+        # Keyed by prompt + stream id, so it only needs to cover recent prompts
+        self.seen_prompts = BoundedSet(MAS_SEEN_PROMPTS)
         
         # Track if we're currently inside a tag
         self.inside_tag = False
         self.current_tag_type = None
-        self.current_tag_content = ""
+        self.current_tag_parts = []
         self.current_stream_id = None
         self.stream_counter = 0
         
+        # Tag content not yet sent as stream_delta
+        self.delta_chars = delta_chars
+        self.delta_interval = delta_ms / 1000
+        self.delta_parts = []
+        self.delta_len = 0
+        self.last_delta_time = 0.0
+        
+        # Top-level JSON fields sent as stream_field events while the tag streams
+        self.stream_fields = tuple(stream_fields)
+        self.field_stream: Optional[JsonFieldStream] = None
+        
         # Track pending prompts from USER_INPUT tags
         self.pending_prompt = None
         self.needs_input = False
@@ -368,149 +911,203 @@ class TagAwareOutputBuffer:
         # Track if we've recently handled a hypothesis prompt via USER_INPUT
         self.handled_hypothesis_via_tag = False
         
+        # Called as listener(tag_type, parsed) for every completed tag
+        self.tag_listeners: List[Callable] = []
+        
+        # Events produced by the parsing core, not yet handed out
+        self.outbox: List[dict] = []
+        
+    async def add_chunk(self, data):
+        """Scan a chunk of output (str, or bytes in binary mode) - only send tagged content"""
+        await self._send_all(self.feed(data))
+    
     async def add_char(self, char: str):
-        """Character-by-character processing - only send when inside tags"""
-        self.buffer += char
-        
-        # Check if we're entering a tag
-        for tag_name in TagParser.TAG_PATTERNS.keys():
-            start_pattern = f'<<<{tag_name}>>>'
-            if self.buffer.endswith(start_pattern):
-                self.inside_tag = True
-                self.current_tag_type = tag_name
-                self.current_tag_content = ""
-                self.stream_counter += 1
-                self.current_stream_id = f"stream_{self.stream_counter}"
-                
-                # Send stream start notification
-                if self.ws_manager:
-                    await self.ws_manager.send_log(self.run_id, {
-                        "type": "stream_start",
-                        "stream_id": self.current_stream_id,
-                        "tag_type": self.current_tag_type
-                    })
-                # Clear the entire buffer after detecting start
-                self.buffer = ""
-                return
+        """Character-by-character entry point (kept for callers that still use it)"""
+        await self.add_chunk(char)
+    
+    def feed(self, data) -> List[dict]:
+        """Synchronous add_chunk: returns the events instead of sending them"""
+        for event, tag_type, value in self.scanner.feed(data):
+            self._handle_scan_event(event, tag_type, value)
+        return self._take_outbox()
+    
+    def _take_outbox(self) -> List[dict]:
+        events, self.outbox = self.outbox, []
+        return events
+    
+    async def _send_all(self, events: List[dict]):
+        if self.ws_manager:
+            for payload in events:
+                await self.ws_manager.send_log(self.run_id, payload)
+    
+    def _handle_scan_event(self, event: str, tag_type: Optional[str], value):
+        if event == 'content':
+            if self.scanner.binary:
+                value = self.content_decoder.decode(value)
+            self.current_tag_parts.append(value)
+            self.delta_parts.append(value)
+            self.delta_len += len(value)
+            self._stream_fields(value)
+            if (self.delta_len >= self.delta_chars
+                    or time.monotonic() - self.last_delta_time >= self.delta_interval):
+                self._queue_delta()
+        elif event == 'text':
+            pass  # untagged output is not sent; OutputLineTracker follows its prompts
+        elif event == 'start':
+            self._start_tag(tag_type)
+        else:
+            self._end_tag()
+    
+    def _start_tag(self, tag_type: str):
+        self.inside_tag = True
+        self.current_tag_type = tag_type
+        self.current_tag_parts = []
+        self.content_decoder = OutputDecoder()
+        self.delta_parts = []
+        self.delta_len = 0
+        self.last_delta_time = time.monotonic()
+        self.field_stream = JsonFieldStream(self.stream_fields) if self.stream_fields else None
+        self.stream_counter += 1
+        self.current_stream_id = f"stream_{self.stream_counter}"
+        
+        # Send stream start notification
+        self.outbox.append({
+            "type": "stream_start",
+            "stream_id": self.current_stream_id,
+            "tag_type": self.current_tag_type
+        })
+    
+    def _stream_fields(self, text: str):
+        if self.field_stream is None:
+            return
+        for field, value in self.field_stream.feed(text):
+            self.outbox.append({
+                "type": "stream_field",
+                "stream_id": self.current_stream_id,
+                "tag_type": self.current_tag_type,
+                "data": {"field": field, "value": value}
+            })
+        if self.field_stream.done:
+            self.field_stream = None
+    
+    async def send_delta(self):
+        """Send tag content accumulated since the last stream_delta (no-op outside a tag)"""
+        await self._send_all(self.take_delta())
+    
+    def take_delta(self) -> List[dict]:
+        """Synchronous send_delta"""
+        self._queue_delta()
+        return self._take_outbox()
+    
+    def _queue_delta(self):
+        if not self.inside_tag:
+            return
+        self.last_delta_time = time.monotonic()
+        content = "".join(self.delta_parts)
+        self.delta_parts = []
+        self.delta_len = 0
+        if content:
+            self.outbox.append({
+                "type": "stream_delta",
+                "stream_id": self.current_stream_id,
+                "tag_type": self.current_tag_type,
+                "data": {"content": content}
+            })
+    
+    def _end_tag(self):
+        # Parse and send the complete tag content
+        tail = self.content_decoder.flush()
+        self.current_tag_parts.append(tail)
+        self.delta_parts.append(tail)
+        self._stream_fields(tail)
+        self._queue_delta()
+        self.field_stream = None
+        self._complete_tag(self._parse_tag_content(self.current_tag_type, "".join(self.current_tag_parts)))
+    
+    def feed_event(self, tag_type: str, data) -> List[dict]:
+        """A complete tag that arrived already structured (event side channel)
         
-        # Check if we're exiting a tag
-        if self.inside_tag and self.current_tag_type:
-            end_pattern = f'<<<END_{self.current_tag_type}>>>'
+        Produces the same stream_start / parsed / stream_end events and prompt
+        state as the scanned tag, without marker scanning or clean_all_tags
+        """
+        self._start_tag(tag_type)
+        self.field_stream = None
+        self._complete_tag({
+            "type": tag_type.lower().replace('_', '-'),
+            "data": data if isinstance(data, dict) else {"content": data},
+            "tag_type": tag_type
+        })
+        return self._take_outbox()
+    
+    async def add_event(self, tag_type: str, data):
+        await self._send_all(self.feed_event(tag_type, data))
+    
+    def _complete_tag(self, parsed: Optional[dict]):
+        if parsed:
+            for listener in self.tag_listeners:
+                listener(self.current_tag_type, parsed)
+        
+        # IMPORTANT: Handle USER_INPUT tags specially
+        if parsed and self.current_tag_type == "USER_INPUT":
+            # Send the tag to WebSocket first
+            parsed['stream_id'] = self.current_stream_id
+            parsed['stream_complete'] = True
+            self.outbox.append(parsed)
             
-            # Check if the buffer ends with the complete end pattern
-            if self.buffer.endswith(end_pattern):
-                # Parse and send the complete tag content
-                parsed = self._parse_tag_content(self.current_tag_type, self.current_tag_content)
-                
-                # IMPORTANT: Handle USER_INPUT tags specially
-                if parsed and self.current_tag_type == "USER_INPUT":
-                    # Send the tag to WebSocket first
-                    if self.ws_manager:
-                        parsed['stream_id'] = self.current_stream_id
-                        parsed['stream_complete'] = True
-                        await self.ws_manager.send_log(self.run_id, parsed)
-                    
-                    # Check if this needs user input (value is null)
-                    tag_data = parsed.get('data', {})
-                    prompt_text = tag_data.get('prompt', '')
-                    value = tag_data.get('value')
-                    
-                    # If value is null, set up for input collection
-                    if value is None and prompt_text:
-                        # Clean up the prompt text
-                        clean_prompt = prompt_text.strip()
-                        
-                        # Check if this is a hypothesis prompt
-                        if "hypothesis" in clean_prompt.lower():
-                            self.handled_hypothesis_via_tag = True
-                        
-                        # Check if we haven't already handled this prompt
-                        prompt_key = f"{clean_prompt}_{self.current_stream_id}"
-                        if prompt_key not in self.seen_prompts:
-                            self.seen_prompts.add(prompt_key)
-                            self.pending_prompt = clean_prompt
-                            self.needs_input = True
-                            print(f"[SHEPHERD] USER_INPUT needs input: {clean_prompt}")
-                            
-                            # Send prompt notification immediately
-                            if self.ws_manager:
-                                await self.ws_manager.send_log(self.run_id, {
-                                    "type": "prompt",
-                                    "data": {
-                                        "prompt": clean_prompt,
-                                        "multiline": False
-                                    }
-                                })
+            # Check if this needs user input (value is null)
+            tag_data = parsed.get('data', {})
+            prompt_text = tag_data.get('prompt', '')
+            value = tag_data.get('value')
+            
+            # If value is null, set up for input collection
+            if value is None and prompt_text:
+                # Clean up the prompt text
+                clean_prompt = prompt_text.strip()
                 
-                elif parsed and self.ws_manager:
-                    # Send other tags normally
-                    parsed['stream_id'] = self.current_stream_id
-                    parsed['stream_complete'] = True
-                    await self.ws_manager.send_log(self.run_id, parsed)
+                # Check if this is a hypothesis prompt
+                if "hypothesis" in clean_prompt.lower():
+                    self.handled_hypothesis_via_tag = True
                 
-                # Send stream end notification
-                if self.ws_manager:
-                    await self.ws_manager.send_log(self.run_id, {
-                        "type": "stream_end",
-                        "stream_id": self.current_stream_id,
-                        "tag_type": self.current_tag_type
+                # Check if we haven't already handled this prompt
+                prompt_key = f"{clean_prompt}_{self.current_stream_id}"
+                if prompt_key not in self.seen_prompts:
+                    self.seen_prompts.add(prompt_key)
+                    self.pending_prompt = clean_prompt
+                    self.needs_input = True
+                    print(f"[SHEPHERD] USER_INPUT needs input: {clean_prompt}")
+                    
+                    # Send prompt notification immediately
+                    self.outbox.append({
+                        "type": "prompt",
+                        "data": {
+                            "prompt": clean_prompt,
+                            "multiline": False
+                        }
                     })
-                
-                # Reset tag tracking
-                self.inside_tag = False
-                self.current_tag_type = None
-                self.current_tag_content = ""
-                self.current_stream_id = None
-                self.buffer = ""
-                return
-            else:
-                # Only accumulate content if we're not building the end pattern
-                for i in range(1, len(end_pattern)):
-                    if self.buffer.endswith(end_pattern[:i]):
-                        return
-                
-                # Safe to accumulate this character
-                self.current_tag_content += char
-                return  # Important: skip other processing while in tag
         
-        # Skip all processing if we're inside a tag
-        if self.inside_tag:
-            return
+        elif parsed:
+            # Send other tags normally
+            parsed['stream_id'] = self.current_stream_id
+            parsed['stream_complete'] = True
+            self.outbox.append(parsed)
         
-        # Handle newlines for non-tag content
-        if char == '\n':
-            line = self.buffer.strip()
-            
-            # Skip "Run another MAS?" - it comes through tags
-            if "Run another MAS?" in line:
-                self.buffer = ""
-                return
-                
-            hypothesis_patterns = [
-                "Enter hypothesis (press Enter twice when done):",
-                "Enter your detailed vulnerability hypothesis"
-            ]
-            
-            is_hypothesis_prompt = any(pattern in line for pattern in hypothesis_patterns)
-            
-            if self.prompt_detector.is_likely_prompt(line) or is_hypothesis_prompt:
-                self.hold_buffer = self.buffer
-                self.buffer = ""
-                return
-            else:
-                self.hold_buffer = ""
-                self.buffer = ""
-        else:
-            # Clear buffer if it gets too large and we're not in a tag
-            if len(self.buffer) > 500 and not self.inside_tag:
-                self.buffer = ""
+        # Send stream end notification
+        self.outbox.append({
+            "type": "stream_end",
+            "stream_id": self.current_stream_id,
+            "tag_type": self.current_tag_type
+        })
+        
+        # Reset tag tracking
+        self.inside_tag = False
+        self.current_tag_type = None
+        self.current_tag_parts = []
+        self.current_stream_id = None
     
     def clear_prompt(self):
         """Clear pending prompt"""
         self.pending_prompt = None
         self.needs_input = False
-        self.hold_buffer = ""
-        self.buffer = ""
     
     def reset_for_new_mas(self):
         """Reset state when user chooses to run another MAS"""
@@ -518,31 +1115,34 @@ class TagAwareOutputBuffer:
         self.error_state = False
         self.prompt_detector.seen_prompts.clear()
         self.inside_tag = False
+        self.scanner.current_tag = None
         self.current_tag_type = None
-        self.current_tag_content = ""
+        self.current_tag_parts = []
+        self.delta_parts = []
+        self.delta_len = 0
         self.current_stream_id = None
         self.pending_prompt = None
         self.needs_input = False
         self.handled_hypothesis_via_tag = False
     
-    async def flush_if_not_prompt(self):
-        """Modified: Only clear buffers"""
-        self.hold_buffer = ""
-        self.buffer = ""
-    
     async def force_flush(self):
         """Modified: Check if we have incomplete tag data to send"""
-        if self.inside_tag and self.current_tag_content:
+        await self._send_all(self.finish())
+    
+    def finish(self) -> List[dict]:
+        """Synchronous force_flush"""
+        for event, tag_type, value in self.scanner.flush():
+            self._handle_scan_event(event, tag_type, value)
+        self._queue_delta()
+        if self.inside_tag and self.current_tag_parts:
             # Send incomplete tag warning
-            if self.ws_manager:
-                await self.ws_manager.send_log(self.run_id, {
-                    "type": "incomplete_tag",
-                    "stream_id": self.current_stream_id,
-                    "tag_type": self.current_tag_type,
-                    "partial_content": clean_all_tags(self.current_tag_content)
-                })
-        self.hold_buffer = ""
-        self.buffer = ""
+            self.outbox.append({
+                "type": "incomplete_tag",
+                "stream_id": self.current_stream_id,
+                "tag_type": self.current_tag_type,
+                "partial_content": clean_all_tags("".join(self.current_tag_parts))
+            })
+        return self._take_outbox()
     
     async def flush(self):
         """Flush any remaining incomplete tags"""
@@ -563,7 +1163,7 @@ class TagAwareOutputBuffer:
             
             if content.startswith('{') and content.endswith('}'):
                 # Now parse the already-cleaned JSON
-                data = json.loads(content)
+                data = json_codec.loads(content)
             else:
                 data = {"content": content}
             
@@ -572,25 +1172,613 @@ class TagAwareOutputBuffer:
                 "data": data,
                 "tag_type": tag_type
             }
-        except json.JSONDecodeError:
+        except json_codec.JSONDecodeError:
             return {
                 "type": tag_type.lower().replace('_', '-'),
                 "data": {"content": content},
                 "tag_type": tag_type
             }
 
+class ProcessOutputBuffer:
+    """TagAwareOutputBuffer stand-in whose parsing runs in a ParserPool worker
+    
+    Events come back from the worker and are sent from here; prompt state set
+    by USER_INPUT tags is mirrored locally. The prompt detector stays in this
+    process because the launch loop drives it on idle ticks.
+    """
+    
+    def __init__(self, pool, ws_manager, run_id):
+        self.pool = pool
+        self.ws_manager = ws_manager
+        self.run_id = run_id
+        self.prompt_detector = PromptDetector()
+        self.error_state = False
+        self.pending_prompt = None
+        self.needs_input = False
+        self.handled_hypothesis_via_tag = False
+        self.tag_listeners: List[Callable] = []
+        self.closed = False
+    
+    async def open(self):
+        await self.pool.open(self.run_id, delta_chars=MAS_STREAM_DELTA_CHARS, delta_ms=MAS_STREAM_DELTA_MS,
+                             stream_fields=MAS_STREAM_FIELDS)
+    
+    async def add_chunk(self, data: bytes):
+        await self._apply(await self.pool.call(self.run_id, "feed", bytes(data)))
+    
+    async def send_delta(self):
+        await self._apply(await self.pool.call(self.run_id, "delta"))
+    
+    async def add_event(self, tag_type: str, data):
+        await self._apply(await self.pool.call(self.run_id, "event", (tag_type, data)))
+    
+    def clear_prompt(self):
+        self.pending_prompt = None
+        self.needs_input = False
+        self.pool.send(self.run_id, "clear_prompt")
+    
+    def reset_for_new_mas(self):
+        self.error_state = False
+        self.prompt_detector.seen_prompts.clear()
+        self.pending_prompt = None
+        self.needs_input = False
+        self.handled_hypothesis_via_tag = False
+        self.pool.send(self.run_id, "reset")
+    
+    async def force_flush(self):
+        try:
+            await self._apply(await self.pool.call(self.run_id, "finish"))
+        finally:
+            self.closed = True
+            self.pool.release(self.run_id)
+    
+    def close(self):
+        """Drop the worker-side state (no-op after force_flush)"""
+        if not self.closed:
+            self.closed = True
+            self.pool.send(self.run_id, "drop")
+            self.pool.release(self.run_id)
+    
+    async def _apply(self, result: dict):
+        if result.get("prompt"):
+            self.pending_prompt = result["prompt"]
+            self.needs_input = True
+        if result.get("hypothesis_via_tag"):
+            self.handled_hypothesis_via_tag = True
+        for payload in result["events"]:
+            if payload.get("stream_complete"):
+                for listener in self.tag_listeners:
+                    listener(payload["tag_type"], payload)
+            if self.ws_manager:
+                await self.ws_manager.send_log(self.run_id, payload)
+
+class OutputLineTracker:
+    """Tracks the current MAS output line for prompt detection, straight from pipe bytes
+    
+    Mirrors the old per-character loop: every finished line goes to the prompt
+    detector, and the line resets on newline unless it holds "Run another MAS?".
+    Lines are found with bytes.find and only the ones that can still be in the
+    detector's history are decoded.
+    """
+    
+    RUN_ANOTHER_MAS = b"Run another MAS?"
+    
+    def __init__(self, detector: PromptDetector):
+        self.detector = detector
+        self.line = bytearray()
+    
+    def feed(self, data: bytes):
+        """Consume a chunk of raw output"""
+        view = memoryview(data)
+        finished = []
+        pos = 0
+        while True:
+            newline = data.find(b'\n', pos)
+            if newline == -1:
+                break
+            if self.line:
+                self.line += view[pos:newline + 1]
+                finished.append(bytes(self.line))
+                keep = self.RUN_ANOTHER_MAS in self.line
+            else:
+                finished.append(view[pos:newline + 1])
+                keep = data.find(self.RUN_ANOTHER_MAS, pos, newline + 1) != -1
+                if keep:
+                    self.line += view[pos:newline + 1]
+            if not keep:
+                self.line.clear()
+            pos = newline + 1
+        self.line += view[pos:]
+        
+        # Older lines would fall out of the detector history anyway
+        recent = []
+        for line in reversed(finished):
+            if len(recent) == self.detector.max_history:
+                break
+            text = bytes(line).decode('utf-8', errors='ignore').strip()
+            if text:
+                recent.append(text)
+        for text in reversed(recent):
+            self.detector.add_line(text)
+    
+    def text(self) -> str:
+        """The current (unfinished) line"""
+        return self.line.decode('utf-8', errors='ignore')
+    
+    def clear(self):
+        self.line.clear()
+
+class OutputRingBuffer:
+    """Fixed-capacity byte ring holding the most recent MAS output
+    
+    Memory stays at capacity bytes no matter how long the run is; writes copy
+    at most two slices into the ring.
+    """
+    
+    def __init__(self, capacity: int = MAS_RECENT_OUTPUT_BYTES):
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.capacity = capacity
+        self.ring = bytearray(capacity)
+        self.pos = 0
+        self.size = 0
+    
+    def write(self, data: bytes):
+        n = len(data)
+        if n >= self.capacity:
+            self.ring[:] = data[n - self.capacity:]
+            self.pos = 0
+            self.size = self.capacity
+            return
+        first = min(n, self.capacity - self.pos)
+        self.ring[self.pos:self.pos + first] = data[:first]
+        self.ring[:n - first] = data[first:]
+        self.pos = (self.pos + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+    
+    def tail(self, n: Optional[int] = None) -> bytes:
+        """The last n bytes written (all retained bytes by default)"""
+        n = self.size if n is None else max(0, min(n, self.size))
+        start = (self.pos - n) % self.capacity
+        if start + n <= self.capacity:
+            return bytes(self.ring[start:start + n])
+        return bytes(self.ring[start:]) + bytes(self.ring[:self.pos])
+    
+    def text(self, n: Optional[int] = None) -> str:
+        return self.tail(n).decode('utf-8', errors='ignore')
+    
+    def __len__(self):
+        return self.size
+
+class SentinelMatcher:
+    """Incremental search for a fixed byte string across chunk boundaries
+    
+    Only the last len(sentinel) - 1 bytes are carried between chunks, so each
+    byte is examined a constant number of times.
+    """
+    
+    def __init__(self, sentinel: bytes = RECURSION_LIMIT_SENTINEL_BYTES):
+        self.sentinel = sentinel
+        self.tail = b""
+        self.found = False
+    
+    def feed(self, data: bytes) -> int:
+        """Offset in data just past the first match, or -1 if not (yet) seen"""
+        if self.found:
+            return -1
+        keep = len(self.sentinel) - 1
+        # Match straddling the previous chunk, else fully inside this one
+        cut = (self.tail + data[:keep]).find(self.sentinel)
+        if cut != -1:
+            cut += len(self.sentinel) - len(self.tail)
+        else:
+            cut = data.find(self.sentinel)
+            if cut != -1:
+                cut += len(self.sentinel)
+        if cut != -1:
+            self.found = True
+        elif keep:
+            self.tail = (self.tail + data[-keep:])[-keep:]
+        return cut
+
+class EventChannel:
+    """Structured MAS events on an extra pipe instead of <<<TAG>>> markers in stdout
+    
+    The write end is passed to the child and advertised as SHEPHERD_EVENT_FD.
+    A MAS that supports it writes one JSON object per line:
+        {"tag": "EXECUTOR_TOOL_CALL", "data": {...}}
+    Each becomes the same events a scanned tag would. With the channel on,
+    stdout is plain log output: tags there are not parsed, since they could
+    race the channel and arrive out of order.
+    """
+    
+    ENV_VAR = "SHEPHERD_EVENT_FD"
+    
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.events_seen = 0
+        self.task: Optional[asyncio.Task] = None
+        self.attached = False
+    
+    def child_env(self, env: dict) -> dict:
+        env[self.ENV_VAR] = str(self.write_fd)
+        return env
+    
+    def child_started(self):
+        """Drop our copy of the write end so EOF arrives when the child exits"""
+        os.close(self.write_fd)
+    
+    def start(self, output_buffer, on_event: Callable):
+        self.task = asyncio.create_task(self._run(output_buffer, on_event))
+    
+    async def _run(self, output_buffer, on_event: Callable):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(self.read_fd, 'rb', buffering=0)
+        )
+        self.attached = True
+        try:
+            pending = b""
+            while True:
+                data = await reader.read(MAS_READ_CHUNK_SIZE)
+                if not data:
+                    break
+                *lines, pending = (pending + data).split(b'\n')
+                for line in lines:
+                    if line.strip():
+                        await self._handle_line(line, output_buffer)
+                        on_event()
+        finally:
+            transport.close()
+    
+    async def _handle_line(self, line: bytes, output_buffer):
+        try:
+            event = json_codec.loads(line)
+            tag_type = event["tag"]
+            if not isinstance(tag_type, str):
+                raise TypeError("tag must be a string")
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[SHEPHERD] Ignoring malformed event channel line ({e}): {line[:200]!r}")
+            return
+        self.events_seen += 1
+        # Same as tags in stdout: nothing is streamed after GRAPH_RECURSION_LIMIT
+        if not output_buffer.error_state:
+            await output_buffer.add_event(tag_type.upper(), event.get("data"))
+    
+    async def close(self, timeout: float = 5.0):
+        """Wait for the remaining events (the child has exited), then stop"""
+        if self.task is not None:
+            try:
+                await asyncio.wait_for(self.task, timeout)
+            except asyncio.TimeoutError:
+                print("[SHEPHERD] Event channel still open after MAS exit, closing it")
+        self.abort()
+    
+    def abort(self):
+        """Stop reading right away (no-op after close)"""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        if not self.attached and self.read_fd is not None:
+            os.close(self.read_fd)
+        self.read_fd = None
+
+class RunProgress:
+    """Liveness of one run, for the stall watchdog
+    
+    The launch loop records output (stdout or event channel), sent input and,
+    with a StdinWaitProbe, whether the child is blocked reading stdin.
+    input_handler calls made through wrap() count as waiting on the user.
+    idle_seconds() is the time since the last of those while the run is not
+    waiting for input, so a run parked at a prompt is never idle.
+    """
+    
+    def __init__(self, on_process_started: Optional[Callable] = None):
+        self.on_process_started = on_process_started
+        self.pid: Optional[int] = None
+        self.last_activity = time.monotonic()
+        self.stdin_blocked = False
+        self.stalled = False
+        self._awaiting_user = 0
+    
+    def process_started(self, pid: int):
+        self.pid = pid
+        self.touch()
+        if self.on_process_started:
+            self.on_process_started(pid)
+    
+    def touch(self):
+        self.last_activity = time.monotonic()
+    
+    @property
+    def awaiting_input(self) -> bool:
+        return self._awaiting_user > 0 or self.stdin_blocked
+    
+    def idle_seconds(self) -> float:
+        if self.awaiting_input:
+            return 0.0
+        return time.monotonic() - self.last_activity
+    
+    def wrap(self, input_handler: Callable) -> Callable:
+        async def handler(*args, **kwargs):
+            self._awaiting_user += 1
+            try:
+                return await input_handler(*args, **kwargs)
+            finally:
+                self._awaiting_user -= 1
+                self.touch()
+        return handler
+
+class ToolLoopDetector:
+    """Spots an agent calling the same tool with the same arguments over and over
+    
+    Tag listener for EXECUTOR_TOOL_CALL. Each call is keyed by its tool name
+    and a hash of its arguments as canonical JSON (keys sorted, whitespace in
+    strings collapsed), so calls that differ only in key order or spacing
+    count as identical. The repeats-th identical call in a row trips the
+    detector (once per streak); a different call starts a new streak.
+    """
+    
+    TOOL_KEYS = ("tool_name", "tool")
+    
+    def __init__(self, repeats: int = MAS_TOOL_LOOP_REPEATS):
+        self.repeats = max(2, repeats)
+        self.last_key = None
+        self.count = 0
+        self.loops = 0
+        self.tripped: Optional[dict] = None
+    
+    def tag(self, tag_type: str, parsed: dict):
+        if tag_type != "EXECUTOR_TOOL_CALL":
+            return
+        data = parsed.get("data")
+        if not isinstance(data, dict):
+            return
+        tool = next((data[key] for key in self.TOOL_KEYS if key in data), None)
+        args = data["args"] if "args" in data else {k: v for k, v in data.items() if k not in self.TOOL_KEYS}
+        key = (str(tool), self.args_hash(args))
+        if key == self.last_key:
+            self.count += 1
+        else:
+            self.last_key = key
+            self.count = 1
+        if self.count == self.repeats:
+            self.loops += 1
+            self.tripped = {"tool_name": tool, "args_hash": key[1], "repeats": self.count}
+    
+    def take(self) -> Optional[dict]:
+        """The loop found since the last call, if any"""
+        tripped, self.tripped = self.tripped, None
+        return tripped
+    
+    @classmethod
+    def args_hash(cls, args) -> str:
+        canonical = json.dumps(cls._normalize(args), sort_keys=True, ensure_ascii=False,
+                               separators=(",", ":"), default=str)
+        return hashlib.blake2b(canonical.encode('utf-8', errors='replace'), digest_size=8).hexdigest()
+    
+    @classmethod
+    def _normalize(cls, value):
+        if isinstance(value, str):
+            return " ".join(value.split())
+        if isinstance(value, dict):
+            return {str(k): cls._normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [cls._normalize(v) for v in value]
+        return value
+
+async def _kill_after(process, grace: float):
+    """SIGKILL the process if it is still running grace seconds after SIGTERM"""
+    await asyncio.sleep(grace)
+    if process.returncode is None:
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+class InputCoordinator:
+    """Answers USER_INPUT prompts as soon as their tag closes
+    
+    The read loop calls poll() after every chunk; each prompt is then handled
+    in a task, so stdout keeps being drained while input_handler waits.
+    Prompts are answered one at a time, in the order their tags closed.
+    """
+    
+    def __init__(self, process, input_handler: Callable, output_buffer, line_tracker: OutputLineTracker):
+        self.process = process
+        self.input_handler = input_handler
+        self.output_buffer = output_buffer
+        self.detector = output_buffer.prompt_detector
+        self.line_tracker = line_tracker
+        self.prompts: List[str] = []
+        self.task: Optional[asyncio.Task] = None
+    
+    @property
+    def busy(self) -> bool:
+        return self.task is not None and not self.task.done()
+    
+    def poll(self):
+        """Pick up a prompt set by a USER_INPUT tag"""
+        output_buffer = self.output_buffer
+        if not (output_buffer.needs_input and output_buffer.pending_prompt):
+            return
+        prompt_text = output_buffer.pending_prompt
+        print(f"[SHEPHERD] Processing USER_INPUT prompt: {prompt_text}")
+        
+        # Check if this is a hypothesis prompt and mark it
+        if "hypothesis" in prompt_text.lower():
+            output_buffer.handled_hypothesis_via_tag = True
+            # Add to seen prompts to prevent legacy detection
+            self.detector.seen_prompts.add("hypothesis_silent_wait")
+            self.detector.seen_prompts.add("Enter your detailed vulnerability hypothesis:")
+            self.detector.seen_prompts.add("Enter your detailed vulnerability hypothesis")
+        
+        # Clear the pending prompt immediately
+        output_buffer.clear_prompt()
+        
+        self.prompts.append(prompt_text)
+        if not self.busy:
+            self.task = asyncio.create_task(self._answer_prompts())
+    
+    async def _answer_prompts(self):
+        while self.prompts:
+            if not await self._answer(self.prompts.pop(0)):
+                self.prompts.clear()
+    
+    async def _answer(self, prompt_text: str) -> bool:
+        """False once the process can no longer take input"""
+        user_input = await self.input_handler(prompt_text)
+        if user_input is None or self.process.returncode is not None:
+            return True
+        
+        # State for the next MAS round is reset before the answer can produce output
+        if "Run another MAS?" in prompt_text and user_input.lower() in ['y', 'yes']:
+            self.output_buffer.reset_for_new_mas()
+            self.detector.seen_prompts.clear()
+            print("[SHEPHERD] User chose to run another MAS, state reset")
+        self.line_tracker.clear()
+        self.detector.last_input_time = asyncio.get_event_loop().time()
+        
+        try:
+            # Send the input to the process
+            self.process.stdin.write((user_input + '\n').encode())
+            await self.process.stdin.drain()
+            
+            # For hypothesis, send extra newline
+            if "hypothesis" in prompt_text.lower():
+                self.process.stdin.write('\n'.encode())
+                await self.process.stdin.drain()
+            
+            print(f"[SHEPHERD] Sent user input: {user_input}")
+        except (BrokenPipeError, ConnectionResetError, RuntimeError) as e:
+            print(f"[SHEPHERD] Process terminated while sending input: {e}")
+            return False
+        return True
+    
+    async def close(self):
+        """Stop waiting for input (the process has finished)"""
+        self.prompts.clear()
+        if self.busy:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+class ConsoleMirror:
+    """Echoes MAS output to the server console according to a CONSOLE_MIRROR_MODES mode"""
+    
+    def __init__(self, mode: str = MAS_CONSOLE_MIRROR, sample_every: int = MAS_CONSOLE_SAMPLE_EVERY, stream=None):
+        if mode not in CONSOLE_MIRROR_MODES:
+            raise ValueError(f"console mirror mode must be one of {CONSOLE_MIRROR_MODES}, got {mode!r}")
+        self.mode = mode
+        self.sample_every = max(1, sample_every)
+        self.stream = stream
+        self.partial = bytearray()
+        self.lines_seen = 0
+    
+    def write(self, data: bytes):
+        """Raw output chunk"""
+        if self.mode == "line":
+            newline = data.rfind(b'\n')
+            if newline == -1:
+                self.partial += data
+                return
+            self._emit(bytes(self.partial) + data[:newline + 1])
+            self.partial[:] = data[newline + 1:]
+        elif self.mode == "sampled":
+            self._write_sampled(data)
+    
+    def _write_sampled(self, data: bytes):
+        picked = []
+        pos = 0
+        while True:
+            newline = data.find(b'\n', pos)
+            if newline == -1:
+                break
+            if self.lines_seen % self.sample_every == 0:
+                picked.append(bytes(self.partial) + data[pos:newline + 1] if self.partial else data[pos:newline + 1])
+            self.partial.clear()
+            self.lines_seen += 1
+            pos = newline + 1
+        # Only the start of a line that may get sampled is worth keeping
+        if self.lines_seen % self.sample_every == 0:
+            self.partial += data[pos:]
+        if picked:
+            self._emit(b"".join(picked))
+    
+    def tag(self, tag_type: str, parsed: dict):
+        """Completed tag (only echoed in tagged mode)"""
+        if self.mode != "tagged":
+            return
+        data = parsed.get("data")
+        summary = json.dumps(data, ensure_ascii=False, default=str) if data is not None else ""
+        if len(summary) > 200:
+            summary = summary[:200] + "..."
+        self._emit(f"[{tag_type}] {summary}\n".encode('utf-8', errors='replace'))
+    
+    def flush(self):
+        """Write a pending partial line (line mode) - called when output goes idle"""
+        if self.mode == "line" and self.partial:
+            self._emit(bytes(self.partial))
+            self.partial.clear()
+    
+    def _emit(self, data: bytes):
+        stream = self.stream if self.stream is not None else sys.stdout.buffer
+        stream.write(data)
+        stream.flush()
+
 async def launch_mas_interactive(
     run_id: str, 
     job: dict, 
     input_handler: Callable,
     ws_manager=None,
     log_dir: str = "./backend/logs",
+    read_chunk_size: int = MAS_READ_CHUNK_SIZE,
+    console_mirror: str = MAS_CONSOLE_MIRROR,
+    parser_mode: str = MAS_PARSER_MODE,
+    input_probe: bool = MAS_INPUT_PROBE,
+    transport: str = MAS_TRANSPORT,
+    event_channel: bool = MAS_EVENT_CHANNEL,
+    progress: Optional[RunProgress] = None,
+    tool_loop_action: str = MAS_TOOL_LOOP_ACTION,
+    tool_tracer=None,
 ) -> Dict[str, Any]:
     """
     Launch MAS subprocess with tag-based streaming and error handling
-    This version uses character-by-character processing like mas_bridge_4.py
-    but also supports tag parsing
+    Output is read in chunks of up to read_chunk_size bytes (whatever the pipe
+    has available); tags are scanned and lines tracked on the raw bytes, with
+    the same tag and prompt semantics as the per-character mas_bridge_4.py
+    console_mirror picks how the output is echoed to the server console
+    (one of CONSOLE_MIRROR_MODES, default from MAS_CONSOLE_MIRROR)
+    parser_mode "process" moves tag parsing to the shared parser worker pool
+    input_probe uses StdinWaitProbe (where supported) as the authoritative
+    "waiting for input" signal for untagged prompts
+    transport "pty" runs the MAS on a pseudo-terminal instead of pipes
+    event_channel gives the MAS an EventChannel for structured events and stops
+    tag parsing on stdout
+    progress (a RunProgress) is kept up to date for a stall watchdog
+    tool_loop_action (one of TOOL_LOOP_ACTIONS) is what a ToolLoopDetector hit
+    does: send a "tool_loop" event, or send it and terminate the MAS
+    tool_tracer (a tool_latency.ToolCallTracer) times paired tool call/result tags
     """
+    # read(0) would return b"" forever
+    if read_chunk_size < 1:
+        read_chunk_size = MAS_READ_CHUNK_SIZE
+    mirror = ConsoleMirror(console_mirror)
+    if parser_mode not in PARSER_MODES:
+        raise ValueError(f"parser_mode must be one of {PARSER_MODES}, got {parser_mode!r}")
+    if transport not in TRANSPORTS:
+        raise ValueError(f"transport must be one of {TRANSPORTS}, got {transport!r}")
+    if transport == "pty" and not PTY_AVAILABLE:
+        print("[SHEPHERD] pty transport not supported here, using pipe")
+        transport = "pipe"
+    if tool_loop_action not in TOOL_LOOP_ACTIONS:
+        raise ValueError(f"tool_loop_action must be one of {TOOL_LOOP_ACTIONS}, got {tool_loop_action!r}")
+    if progress is None:
+        progress = RunProgress()
+    input_handler = progress.wrap(input_handler)
+    
     # Create log directory if it doesn't exist
     log_path = Path(log_dir)
     log_path.mkdir(parents=True, exist_ok=True)
@@ -637,14 +1825,25 @@ async def launch_mas_interactive(
     # Log file paths
     log_file_path = log_path / f"{run_id}_{timestamp}_output.log"
     
+    # Events go through a bounded per-run queue so a slow client never stalls pipe reads
+    events = None
+    output_buffer = None
+    inputs = None
+    channel = None
+    tool_loop = None
+    loop_kill = None
+    
     try:
+        if ws_manager:
+            events = RunEventQueue(ws_manager, run_id, MAS_EVENT_QUEUE_SIZE, MAS_EVENT_QUEUE_POLICY, log_dir)
+        
         print(f"Starting MAS subprocess...")
         print(f"Command: {' '.join(cmd)}")
         print(f"Working directory: {mas_repo}")
         
         # Send start notification
-        if ws_manager:
-            await ws_manager.send_log(run_id, {
+        if events:
+            await events.send_log(run_id, {
                 "type": "start",
                 "data": {
                     "pid": None,
@@ -653,23 +1852,38 @@ async def launch_mas_interactive(
                 }
             })
         
+        pass_fds = ()
+        if event_channel:
+            channel = EventChannel()
+            channel.child_env(env)
+            pass_fds = (channel.write_fd,)
+        
         # Create subprocess
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-            env=env,
-            cwd=str(mas_repo)
-        )
+        try:
+            if transport == "pty":
+                process = await spawn_pty_process(cmd, env=env, cwd=str(mas_repo), pass_fds=pass_fds)
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    env=env,
+                    cwd=str(mas_repo),
+                    pass_fds=pass_fds
+                )
+        finally:
+            if channel:
+                channel.child_started()
         
         print(f"Process started with PID: {process.pid}")
+        progress.process_started(process.pid)
         print(f"Logging to: {log_file_path}")
         print("-" * 80)
         
         # Send process started notification
-        if ws_manager:
-            await ws_manager.send_log(run_id, {
+        if events:
+            await events.send_log(run_id, {
                 "type": "process_started",
                 "data": {
                     "pid": process.pid,
@@ -678,97 +1892,106 @@ async def launch_mas_interactive(
             })
         
         # Initialize output buffer with tag support
-        output_buffer = TagAwareOutputBuffer(ws_manager, run_id)
+        if parser_mode == "process":
+            pool = await asyncio.to_thread(get_parser_pool, MAS_PARSER_WORKERS)
+            output_buffer = ProcessOutputBuffer(pool, events, run_id)
+            await output_buffer.open()
+        else:
+            output_buffer = TagAwareOutputBuffer(events, run_id, binary=True)
         detector = output_buffer.prompt_detector
+        output_buffer.tag_listeners.append(mirror.tag)
+        loop_detector = None
+        if tool_loop_action != "off":
+            loop_detector = ToolLoopDetector()
+            output_buffer.tag_listeners.append(loop_detector.tag)
+        if tool_tracer:
+            output_buffer.tag_listeners.append(tool_tracer.tag)
         
-        # Main output processing loop (character by character like mas_bridge_4.py)
-        with open(log_file_path, 'w', encoding='utf-8') as log_file:
-            buffer = ""
-            line_buffer = ""
-            all_output = []
+        async def check_tool_loop():
+            """Act on a loop the detector found in the tags parsed so far"""
+            nonlocal tool_loop, loop_kill
+            found = loop_detector.take() if loop_detector else None
+            if not found:
+                return
+            tool_loop = dict(found, action=tool_loop_action)
+            print(f"[SHEPHERD] Agent loop: {found['tool_name']} called {found['repeats']} times "
+                  f"with the same arguments ({tool_loop_action})")
+            if events:
+                await events.send_log(run_id, {"type": "tool_loop", "data": tool_loop})
+            if tool_loop_action == "terminate" and process.returncode is None and loop_kill is None:
+                try:
+                    os.kill(process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                # Same escalation as RunManager.kill_process
+                loop_kill = asyncio.create_task(_kill_after(process, MAS_TOOL_LOOP_KILL_GRACE))
+        
+        # Main output processing loop (chunked reads, bytes-level tag/prompt state)
+        # Log writes are batched off the event loop; leaving the block (error or
+        # cancellation) still drains and fsyncs the file
+        with RunLogWriter(log_file_path, MAS_LOG_FLUSH_BYTES, MAS_LOG_FLUSH_MS / 1000) as log_writer:
+            line_tracker = OutputLineTracker(detector)
+            inputs = InputCoordinator(process, input_handler, output_buffer, line_tracker)
+            if channel:
+                def on_event():
+                    progress.touch()
+                    inputs.poll()
+                channel.start(output_buffer, on_event)
+            recent_output = OutputRingBuffer()
+            recursion_limit = SentinelMatcher()
+            probe = StdinWaitProbe(process.pid) if input_probe else None
+            if probe and probe.available:
+                read_timeout = MAS_INPUT_PROBE_MS / 1000
+            else:
+                probe = None
+                read_timeout = 0.1
             last_char_time = asyncio.get_event_loop().time()
             no_output_count = 0
             error_state = False
             
             while True:
-                # Read one byte at a time for better control
+                # Read whatever is available (up to read_chunk_size bytes)
                 try:
-                    data = await asyncio.wait_for(process.stdout.read(1), timeout=0.1)
+                    data = await asyncio.wait_for(process.stdout.read(read_chunk_size), timeout=read_timeout)
                     no_output_count = 0
                 except asyncio.TimeoutError:
                     no_output_count += 1
+                    mirror.flush()
+                    await check_tool_loop()
                     
                     current_time = asyncio.get_event_loop().time()
                     time_since_last = current_time - last_char_time
+                    buffer = line_tracker.text()
                     
-                    # CHECK FOR PENDING USER_INPUT PROMPTS FIRST
-                    if output_buffer.needs_input and output_buffer.pending_prompt:
-                        prompt_text = output_buffer.pending_prompt
-                        
-                        print(f"[SHEPHERD] Processing USER_INPUT prompt: {prompt_text}")
-                        
-                        # Check if this is a hypothesis prompt and mark it
-                        if "hypothesis" in prompt_text.lower():
-                            output_buffer.handled_hypothesis_via_tag = True
-                            # Add to seen prompts to prevent legacy detection
-                            detector.seen_prompts.add("hypothesis_silent_wait")
-                            detector.seen_prompts.add("Enter your detailed vulnerability hypothesis:")
-                            detector.seen_prompts.add("Enter your detailed vulnerability hypothesis")
-                        
-                        # Clear the pending prompt immediately
-                        output_buffer.clear_prompt()
-                        
-                        # Get user input
-                        user_input = await input_handler(prompt_text)
-                        
-                        if user_input is not None:
-                            try:
-                                if process.returncode is None:
-                                    # Send the input to the process
-                                    process.stdin.write((user_input + '\n').encode())
-                                    await process.stdin.drain()
-                                    
-                                    # For hypothesis, send extra newline
-                                    if "hypothesis" in prompt_text.lower():
-                                        process.stdin.write('\n'.encode())
-                                        await process.stdin.drain()
-                                    
-                                    print(f"[SHEPHERD] Sent user input: {user_input}")
-                                    
-                                    # Special handling for "Run another MAS?"
-                                    if "Run another MAS?" in prompt_text:
-                                        if user_input.lower() in ['y', 'yes']:
-                                            output_buffer.reset_for_new_mas()
-                                            detector.seen_prompts.clear()
-                                            print("[SHEPHERD] User chose to run another MAS, state reset")
-                                    
-                                    # Clear buffers
-                                    buffer = ""
-                                    line_buffer = ""
-                                    detector.last_input_time = current_time
-                                    
-                            except (BrokenPipeError, RuntimeError) as e:
-                                print(f"[SHEPHERD] Process terminated while sending input: {e}")
-                                break
-                        
-                        no_output_count = 0
+                    # USER_INPUT prompts are answered by the input coordinator; while
+                    # one is open the legacy prompt heuristics stay quiet
+                    inputs.poll()
+                    if inputs.busy:
+                        await output_buffer.send_delta()
+                        if process.returncode is not None:
+                            break
                         continue
                     
-                    # Flush non-prompt buffers on timeout
-                    await output_buffer.flush_if_not_prompt()
+                    await output_buffer.send_delta()
+                    
+                    # True/False from the kernel, None = fall back to silence heuristics
+                    waiting = probe.waiting_for_input() if probe else None
+                    progress.stdin_blocked = bool(waiting)
+                    if waiting:
+                        progress.touch()
                     
                     current_buffer = buffer.strip()
-                    recent_output = "".join(all_output[-100:]) if all_output else ""
                     
                     # Check for hypothesis prompt (silent wait) - SKIP if already handled via tag or seen
                     hypothesis_instruction_seen = False
-                    for line in detector.recent_lines[-5:]:
+                    for line in detector.last_lines(5):
                         if "Enter hypothesis (press Enter twice when done):" in line:
                             hypothesis_instruction_seen = True
                             break
                     
                     # Only process if we haven't already handled this via USER_INPUT tag
-                    if hypothesis_instruction_seen and time_since_last > 0.5 and not detector.waiting_for_multiline:
+                    hypothesis_wait = waiting if waiting is not None else time_since_last > 0.5
+                    if hypothesis_instruction_seen and hypothesis_wait and not detector.waiting_for_multiline:
                         if "hypothesis_silent_wait" in detector.seen_prompts:
                             continue
                         
@@ -781,8 +2004,8 @@ async def launch_mas_interactive(
                         detector.seen_prompts.add("hypothesis_silent_wait")
                         output_buffer.clear_prompt()
                         
-                        if ws_manager:
-                            await ws_manager.send_log(run_id, {
+                        if events:
+                            await events.send_log(run_id, {
                                 "type": "prompt",
                                 "data": {
                                     "prompt": "Enter your detailed vulnerability hypothesis:",
@@ -801,8 +2024,7 @@ async def launch_mas_interactive(
                                     await process.stdin.drain()
                                     
                                 detector.waiting_for_multiline = False
-                                buffer = ""
-                                line_buffer = ""
+                                line_tracker.clear()
                                 
                             except (BrokenPipeError, RuntimeError) as e:
                                 print(f"[SHEPHERD] Process terminated while sending input: {e}")
@@ -812,10 +2034,19 @@ async def launch_mas_interactive(
                         continue
                     
                     # Normal prompt detection
-                    if buffer and detector.should_wait_for_input(buffer, time_since_last):
+                    if waiting is None:
+                        is_prompt = bool(buffer) and detector.should_wait_for_input(buffer, time_since_last)
+                    else:
+                        # Blocked on stdin: the prompt is the current line, or the last
+                        # line if it ended with a newline (only if printed since the last input)
+                        if not buffer.strip() and detector.recent_lines and last_char_time > detector.last_input_time:
+                            buffer = detector.recent_lines[-1]
+                        is_prompt = waiting and bool(buffer.strip())
+                    
+                    if is_prompt:
                         prompt_line = buffer.strip()
                         if "Run another MAS?" in prompt_line:
-                            buffer = ""
+                            line_tracker.clear()
                             continue          
                             
                         if "press enter twice" in prompt_line.lower():
@@ -830,8 +2061,8 @@ async def launch_mas_interactive(
                         output_buffer.clear_prompt()
                         detector.seen_prompts.add(prompt_line)
                         
-                        if ws_manager:
-                            await ws_manager.send_log(run_id, {
+                        if events:
+                            await events.send_log(run_id, {
                                 "type": "prompt",
                                 "data": {
                                     "prompt": clean_all_tags(prompt_line),
@@ -847,8 +2078,7 @@ async def launch_mas_interactive(
                                     process.stdin.write((user_input + '\n').encode())
                                     await process.stdin.drain()
                                 
-                                buffer = ""
-                                line_buffer = ""
+                                line_tracker.clear()
                                 detector.last_input_time = current_time
                                 
                             except (BrokenPipeError, RuntimeError) as e:
@@ -867,44 +2097,38 @@ async def launch_mas_interactive(
                 
                 # Update last character time
                 last_char_time = asyncio.get_event_loop().time()
+                progress.touch()
                 
-                # Decode character
-                char = data.decode('utf-8', errors='ignore')
-                
-                # Check for error state
-                if "GRAPH_RECURSION_LIMIT" in "".join(all_output[-500:]):
-                    if not error_state:
+                # Once GRAPH_RECURSION_LIMIT shows up, everything after it bypasses
+                # tag processing (error state: output is only logged and mirrored)
+                # With an event channel stdout is plain logs
+                tagged_data = b"" if error_state or channel else data
+                if not error_state:
+                    cut = recursion_limit.feed(data)
+                    if cut != -1:
                         print(f"[DEBUG] ENTERING ERROR STATE - detected GRAPH_RECURSION_LIMIT")
-                    error_state = True
-                    output_buffer.error_state = True
-                
-                # Always accumulate buffer
-                buffer += char
-                line_buffer += char
+                        error_state = True
+                        output_buffer.error_state = True
+                        tagged_data = b"" if channel else data[:cut]
                 
+                # Normal flow - scan the raw chunk for tags
+                if tagged_data:
+                    await output_buffer.add_chunk(tagged_data)
+                    inputs.poll()
+                    await check_tool_loop()
                 
-                # Process character through output buffer
-                if error_state:
-                    # In error state, send directly
-                    log_file.write(char)
-                    log_file.flush()
-                    print(char, end='', flush=True)
-                    all_output.append(char)
-                else:
-                    # Normal flow - use output buffer with tag processing
-                    await output_buffer.add_char(char)
-                    log_file.write(char)
-                    log_file.flush()
-                    print(char, end='', flush=True)
-                    all_output.append(char)
+                # Line tracking for the prompt heuristics
+                line_tracker.feed(data)
+                recent_output.write(data)
                 
-                # Handle newlines for buffer management
-                if char == '\n':
-                    if buffer.strip():
-                        detector.add_line(buffer.strip())
-                    if "Run another MAS?" not in buffer:
-                        buffer = ""
-                        line_buffer = ""
+                log_writer.write(data)
+                mirror.write(data)
+            
+            if channel:
+                await channel.close()
+            await inputs.close()
+            await asyncio.to_thread(log_writer.close)
+            mirror.flush()
         
         # Force flush any remaining data
         await output_buffer.force_flush()
@@ -920,22 +2144,32 @@ async def launch_mas_interactive(
         print(f"\n[SHEPHERD] Process exited with code: {return_code}")
         
         # Send completion notification
-        if ws_manager:
-            await ws_manager.send_log(run_id, {
+        if events:
+            await events.send_log(run_id, {
                 "type": "complete",
                 "data": {
                     "exit_code": return_code,
                     "success": return_code == 0
                 }
             })
+            await events.close()
+            if events.dropped or events.coalesced or events.spilled:
+                print(f"[SHEPHERD] Event queue: {events.stats()}")
         
-        return {
+        result = {
             "success": return_code == 0,
             "exit_code": return_code,
             "log_file": str(log_file_path),
-            "output": "".join(all_output),
-            "pid": process.pid
+            "log": log_writer.handle(),
+            "output_tail": recent_output.text(),
+            "pid": process.pid,
+            "tool_loop": tool_loop
         }
+        if tool_loop and tool_loop_action == "terminate":
+            # Failed even if the MAS handled SIGTERM and exited 0
+            result["success"] = False
+            result["error"] = f"agent loop: {tool_loop['tool_name']} repeated {tool_loop['repeats']} times"
+        return result
         
     except Exception as e:
         error_msg = f"Failed to launch MAS: {str(e)}"
@@ -943,7 +2177,9 @@ async def launch_mas_interactive(
         import traceback
         traceback.print_exc()
         
-        # Send error notification
+        # Send error notification (after whatever was still queued)
+        if events:
+            await events.close()
         if ws_manager:
             await ws_manager.send_log(run_id, {
                 "type": "error",
@@ -958,6 +2194,19 @@ async def launch_mas_interactive(
             "error": str(e),
             "traceback": traceback.format_exc()
         }
+    
+    finally:
+        # No-ops after a normal finish; clean up if the run failed or was cancelled
+        if inputs and inputs.busy:
+            inputs.task.cancel()
+        if loop_kill:
+            loop_kill.cancel()
+        if channel:
+            channel.abort()
+        if isinstance(output_buffer, ProcessOutputBuffer):
+            output_buffer.close()
+        if events:
+            events.abort()
 
 # Helper function for creating WebSocket-based input handler
 def create_ws_input_handler(run_id: str, input_queue: asyncio.Queue):
@@ -0,0 +1,199 @@
+# parser_pool.py
+import asyncio
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+def _worker_main(requests, results) -> None:
+    """
+    Worker process: keeps one TagAwareOutputBuffer per run and answers
+    (request_id, run_id, op, arg) messages; request_id None means no reply
+    """
+    from .mas_bridge_tags_output import TagAwareOutputBuffer
+
+    buffers: Dict[str, TagAwareOutputBuffer] = {}
+    while True:
+        message = requests.get()
+        if message is None:
+            return
+        request_id, run_id, op, arg = message
+        try:
+            if op == "open":
+                buffers[run_id] = TagAwareOutputBuffer(None, run_id, binary=True, **arg)
+                result = None
+            elif op == "drop":
+                buffers.pop(run_id, None)
+                result = None
+            else:
+                result = _apply(buffers, run_id, op, arg)
+            ok = True
+        except Exception as e:
+            result = f"{type(e).__name__}: {e}"
+            ok = False
+        if request_id is not None:
+            results.put((request_id, ok, result))
+
+
+def _apply(buffers, run_id: str, op: str, arg) -> Any:
+    output_buffer = buffers[run_id]
+    if op == "feed":
+        events = output_buffer.feed(arg)
+    elif op == "delta":
+        events = output_buffer.take_delta()
+    elif op == "event":
+        events = output_buffer.feed_event(*arg)
+    elif op == "finish":
+        del buffers[run_id]
+        return {"events": output_buffer.finish()}
+    elif op == "clear_prompt":
+        output_buffer.clear_prompt()
+        return None
+    elif op == "reset":
+        output_buffer.reset_for_new_mas()
+        return None
+    else:
+        raise ValueError(f"unknown op {op!r}")
+
+    # Prompt state set by USER_INPUT tags is reported once, then owned by the caller
+    result = {
+        "events": events,
+        "prompt": output_buffer.pending_prompt if output_buffer.needs_input else None,
+        "hypothesis_via_tag": output_buffer.handled_hypothesis_via_tag,
+    }
+    output_buffer.pending_prompt = None
+    output_buffer.needs_input = False
+    output_buffer.handled_hypothesis_via_tag = False
+    return result
+
+
+class ParserPool:
+    """
+    • N worker processes that run the MAS output parser off the event loop
+    • Each run is pinned to the least busy worker, which keeps its parser
+      state between chunks
+    • call() awaits a reply, send() is fire-and-forget; both keep per-run order
+    """
+
+    POLL_SECONDS = 1.0
+
+    def __init__(self, workers: int) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        self._requests = [ctx.Queue() for _ in range(workers)]
+        self._results = ctx.Queue()
+        self._processes = [
+            ctx.Process(target=_worker_main, args=(requests, self._results),
+                        name=f"mas-parser-{i}", daemon=True)
+            for i, requests in enumerate(self._requests)
+        ]
+        for process in self._processes:
+            process.start()
+        self._runs: Dict[str, int] = {}
+        self._load = [0] * workers
+        self._pending: Dict[int, Tuple[int, asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_results, name="mas-parser-results", daemon=True)
+        self._reader.start()
+
+    async def open(self, run_id: str, **options) -> None:
+        with self._lock:
+            worker = min(range(len(self._load)), key=self._load.__getitem__)
+            self._load[worker] += 1
+            self._runs[run_id] = worker
+        await self.call(run_id, "open", options)
+
+    def release(self, run_id: str) -> None:
+        with self._lock:
+            worker = self._runs.pop(run_id, None)
+            if worker is not None:
+                self._load[worker] -= 1
+
+    async def call(self, run_id: str, op: str, arg=None) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        worker = self._runs[run_id]
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = (worker, loop, future)
+        self._requests[worker].put((request_id, run_id, op, arg))
+        return await future
+
+    def send(self, run_id: str, op: str, arg=None) -> None:
+        self._requests[self._runs[run_id]].put((None, run_id, op, arg))
+
+    def _read_results(self) -> None:
+        next_check = time.monotonic() + self.POLL_SECONDS
+        while True:
+            try:
+                message = self._results.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                message = ()
+            # On a timer rather than only when idle: results from other workers
+            # can keep the queue busy indefinitely
+            if time.monotonic() >= next_check:
+                self._fail_dead_workers()
+                next_check = time.monotonic() + self.POLL_SECONDS
+            if message is None:
+                return
+            if not message:
+                continue
+            request_id, ok, result = message
+            with self._lock:
+                entry = self._pending.pop(request_id, None)
+            if entry is not None:
+                _, loop, future = entry
+                loop.call_soon_threadsafe(self._resolve, future, ok, result)
+
+    def _fail_dead_workers(self) -> None:
+        dead = {i for i, process in enumerate(self._processes) if not process.is_alive()}
+        if not dead or self._closed:
+            return
+        with self._lock:
+            failed = [rid for rid, (worker, _, _) in self._pending.items() if worker in dead]
+            entries = [self._pending.pop(rid) for rid in failed]
+        for worker, loop, future in entries:
+            loop.call_soon_threadsafe(self._resolve, future, False, f"parser worker {worker} died")
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, ok: bool, result) -> None:
+        if future.done():
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(result))
+
+    def shutdown(self) -> None:
+        self._closed = True
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+        self._results.put(None)
+        self._reader.join(timeout=5)
+
+
+_pool: Optional[ParserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_parser_pool(workers: int) -> ParserPool:
+    """Process-wide pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ParserPool(workers)
+        return _pool
+
+
+def shutdown_parser_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
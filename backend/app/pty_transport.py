@@ -0,0 +1,100 @@
+# pty_transport.py
+import asyncio
+import errno
+import os
+
+try:
+    import pty
+    import termios
+except ImportError:  # not available on Windows
+    pty = None
+    termios = None
+
+PTY_AVAILABLE = pty is not None
+
+
+class PtyReader:
+    """StreamReader over the pty master; EIO (slave side closed) reads as EOF"""
+
+    def __init__(self, reader: asyncio.StreamReader) -> None:
+        self._reader = reader
+
+    async def read(self, n: int = -1) -> bytes:
+        try:
+            return await self._reader.read(n)
+        except OSError as e:
+            if e.errno == errno.EIO:
+                return b""
+            raise
+
+
+class PtyProcess:
+    """
+    • asyncio Process whose stdin/stdout/stderr are one pseudo-terminal
+    • Exposes the pid/returncode/stdin/stdout/wait() subset the bridge uses
+    """
+
+    def __init__(self, process, stdout: PtyReader, stdin: asyncio.StreamWriter) -> None:
+        self._process = process
+        self.stdout = stdout
+        self.stdin = stdin
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    @property
+    def returncode(self):
+        return self._process.returncode
+
+    async def wait(self) -> int:
+        return await self._process.wait()
+
+
+def _configure_slave(fd: int) -> None:
+    """No echo of our input, no canonical-mode line limit, no \\n -> \\r\\n"""
+    attrs = termios.tcgetattr(fd)
+    attrs[1] &= ~termios.ONLCR                       # oflag
+    attrs[3] &= ~(termios.ECHO | termios.ICANON)     # lflag
+    attrs[6][termios.VMIN] = 1
+    attrs[6][termios.VTIME] = 0
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+
+
+async def spawn_pty_process(cmd, env=None, cwd=None, pass_fds=()) -> PtyProcess:
+    """Start cmd attached to a new pty, so the child sees a terminal and line-buffers stdout"""
+    if not PTY_AVAILABLE:
+        raise RuntimeError("pty transport is not supported on this platform")
+
+    master, slave = pty.openpty()
+    try:
+        _configure_slave(slave)
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=slave,
+            stdout=slave,
+            stderr=slave,
+            env=env,
+            cwd=cwd,
+            start_new_session=True,
+            pass_fds=pass_fds,
+        )
+    except BaseException:
+        os.close(master)
+        raise
+    finally:
+        os.close(slave)
+
+    loop = asyncio.get_running_loop()
+    write_fd = os.dup(master)
+
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(master, 'rb', buffering=0)
+    )
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()),
+        os.fdopen(write_fd, 'wb', buffering=0),
+    )
+    writer = asyncio.StreamWriter(transport, protocol, None, loop)
+    return PtyProcess(process, PtyReader(reader), writer)
@@ -0,0 +1,206 @@
+# tool_latency.py
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from . import json_codec
+
+# Histogram bucket upper bounds (the last bucket is unbounded)
+LATENCY_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+SIZE_BUCKETS_BYTES = (1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+
+TOOL_KEYS = ("tool_name", "tool")
+
+
+def _tool_name(data) -> str:
+    if isinstance(data, dict):
+        for key in TOOL_KEYS:
+            if data.get(key):
+                return str(data[key])
+    return "unknown"
+
+
+def _payload_bytes(data) -> int:
+    try:
+        return len(json_codec.dumps(data).encode('utf-8', errors='surrogatepass'))
+    except TypeError:
+        return len(str(data).encode('utf-8', errors='surrogatepass'))
+
+
+class ToolCallTracer:
+    """
+    • Tag listener that pairs each EXECUTOR_TOOL_CALL with the next
+      EXECUTOR_TOOL_RESULT of the same tool (first in, first out; a result
+      without a tool name takes the oldest open call)
+    • Every pair becomes a record: tool_name, started_at, latency_ms (wall
+      clock between the two tags being parsed), call_bytes, result_bytes
+    • The last max_records records are kept for the run's timing table;
+      on_record (e.g. ToolLatencyStats.add) sees all of them
+    • At most max_open calls per tool wait for a result; older ones are
+      dropped and counted in evicted_calls
+    """
+
+    def __init__(self, on_record: Optional[Callable] = None, max_records: int = 10000,
+                 max_open: int = 100) -> None:
+        self.on_record = on_record
+        self.records: deque = deque(maxlen=max_records)
+        self.max_open = max(1, max_open)
+        self.unmatched_results = 0
+        self.evicted_calls = 0
+        self._open: Dict[str, deque] = {}
+
+    def tag(self, tag_type: str, parsed: dict) -> None:
+        if tag_type == "EXECUTOR_TOOL_CALL":
+            self._call(parsed.get("data"))
+        elif tag_type == "EXECUTOR_TOOL_RESULT":
+            self._result(parsed.get("data"))
+
+    def _call(self, data) -> None:
+        tool = _tool_name(data)
+        calls = self._open.get(tool)
+        if calls is None:
+            calls = self._open[tool] = deque(maxlen=self.max_open)
+        elif len(calls) == self.max_open:
+            self.evicted_calls += 1
+        calls.append((time.monotonic(), datetime.utcnow().isoformat(), _payload_bytes(data)))
+
+    def _result(self, data) -> None:
+        tool = _tool_name(data)
+        if not self._open.get(tool):
+            tool = self._oldest_open() if tool == "unknown" else None
+        if tool is None:
+            self.unmatched_results += 1
+            return
+        started, started_at, call_bytes = self._open[tool].popleft()
+        record = {
+            "tool_name": tool,
+            "started_at": started_at,
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+            "call_bytes": call_bytes,
+            "result_bytes": _payload_bytes(data),
+        }
+        self.records.append(record)
+        if self.on_record:
+            self.on_record(record)
+
+    def _oldest_open(self) -> Optional[str]:
+        open_calls = [(calls[0][0], tool) for tool, calls in self._open.items() if calls]
+        return min(open_calls)[1] if open_calls else None
+
+    @property
+    def open_calls(self) -> int:
+        return sum(len(calls) for calls in self._open.values())
+
+    def table(self) -> dict:
+        """Per-call records plus a per-tool summary, slowest total first"""
+        summary: Dict[str, dict] = {}
+        for record in self.records:
+            tool = summary.setdefault(record["tool_name"], {
+                "tool_name": record["tool_name"], "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "result_bytes": 0,
+            })
+            tool["calls"] += 1
+            tool["total_ms"] += record["latency_ms"]
+            tool["max_ms"] = max(tool["max_ms"], record["latency_ms"])
+            tool["result_bytes"] += record["result_bytes"]
+        for tool in summary.values():
+            tool["total_ms"] = round(tool["total_ms"], 1)
+            tool["mean_ms"] = round(tool["total_ms"] / tool["calls"], 1)
+        return {
+            "calls": list(self.records),
+            "tools": sorted(summary.values(), key=lambda tool: tool["total_ms"], reverse=True),
+            "open_calls": self.open_calls,
+            "evicted_calls": self.evicted_calls,
+            "unmatched_results": self.unmatched_results,
+        }
+
+
+class ToolTimingArchive:
+    """Timing tables of finished runs; past maxsize the least recently used is dropped"""
+
+    def __init__(self, maxsize: int = 100) -> None:
+        self.maxsize = max(1, maxsize)
+        self._tables: "OrderedDict[str, dict]" = OrderedDict()
+
+    def put(self, run_id: str, table: dict) -> None:
+        self._tables[run_id] = table
+        self._tables.move_to_end(run_id)
+        while len(self._tables) > self.maxsize:
+            self._tables.popitem(last=False)
+
+    def get(self, run_id: str) -> Optional[dict]:
+        table = self._tables.get(run_id)
+        if table is not None:
+            self._tables.move_to_end(run_id)
+        return table
+
+
+class _Histogram:
+    def __init__(self, bounds) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value: float) -> None:
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None past the last bound)"""
+        target = q * sum(self.counts)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else None
+        return None
+
+    def buckets(self) -> List[dict]:
+        return [{"le": bound, "count": count}
+                for bound, count in zip(list(self.bounds) + [None], self.counts)]
+
+
+class ToolLatencyStats:
+    """
+    • Latency and result size histograms per tool name, across all runs
+    • Fixed buckets (LATENCY_BUCKETS_MS, SIZE_BUCKETS_BYTES), so memory stays
+      constant however many calls are recorded
+    """
+
+    def __init__(self) -> None:
+        self._tools: Dict[str, dict] = {}
+
+    def add(self, record: dict) -> None:
+        tool = self._tools.get(record["tool_name"])
+        if tool is None:
+            tool = self._tools[record["tool_name"]] = {
+                "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "result_bytes": 0,
+                "latency": _Histogram(LATENCY_BUCKETS_MS), "size": _Histogram(SIZE_BUCKETS_BYTES),
+            }
+        tool["calls"] += 1
+        tool["total_ms"] += record["latency_ms"]
+        tool["max_ms"] = max(tool["max_ms"], record["latency_ms"])
+        tool["result_bytes"] += record["result_bytes"]
+        tool["latency"].add(record["latency_ms"])
+        tool["size"].add(record["result_bytes"])
+
+    def snapshot(self) -> dict:
+        """Per-tool totals, approximate p50/p95 and histograms, slowest total first"""
+        tools = [
+            {
+                "tool_name": name,
+                "calls": tool["calls"],
+                "total_ms": round(tool["total_ms"], 1),
+                "mean_ms": round(tool["total_ms"] / tool["calls"], 1),
+                "max_ms": tool["max_ms"],
+                "p50_ms": tool["latency"].quantile(0.5),
+                "p95_ms": tool["latency"].quantile(0.95),
+                "result_bytes": tool["result_bytes"],
+                "latency_histogram_ms": tool["latency"].buckets(),
+                "result_size_histogram_bytes": tool["size"].buckets(),
+            }
+            for name, tool in self._tools.items()
+        ]
+        return {"tools": sorted(tools, key=lambda tool: tool["total_ms"], reverse=True)}
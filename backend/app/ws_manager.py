@@ -1,17 +1,38 @@
 # ws_manager.py
+import asyncio
 from collections import defaultdict, deque
-from typing import Dict, Set
+from pathlib import Path
+from typing import Dict, Optional, Set
 from fastapi import WebSocket
+
+from .blob_store import BlobStore
+from .json_codec import dumps
+from .log_writer import RunLogWriter
+
+
 class WebSocketManager:
     """
     • Keeps {run_id → set(WebSocket)}  
-    • Stores the last N messages so late joiners can catch up
+    • Stores the last N messages so late joiners can catch up; stream_delta
+      and stream_field events are live-only (the parsed tag event that ends
+      the stream carries the same content), so they never push tags out of
+      the backlog and are not written to the event log
+    • Each payload is encoded once; the backlog, every socket and the event
+      log all get that same JSON text
+    • With a blob_store, oversized payload strings are replaced by a preview
+      and a blob reference before they are cached or sent
+    • With an event_log_dir, every event (as sent, so bodies by digest) is
+      also appended to <run_id>_events.jsonl until close_run()
     """
     MAX_BUFFER = 2000         # keep last 2 000 log msgs ≈ a few MB total
+    LIVE_ONLY_EVENTS = {"stream_delta", "stream_field"}
 
-    def __init__(self) -> None:
+    def __init__(self, blob_store: Optional[BlobStore] = None, event_log_dir=None) -> None:
         self._conns:   Dict[str, Set[WebSocket]] = defaultdict(set)
         self._buffers: Dict[str, deque]          = defaultdict(lambda: deque(maxlen=self.MAX_BUFFER))
+        self.blob_store = blob_store
+        self.event_log_dir = Path(event_log_dir) if event_log_dir else None
+        self._event_logs: Dict[str, RunLogWriter] = {}
 
     async def connect(self, run_id: str, ws: WebSocket) -> None:
         await ws.accept()
@@ -21,22 +42,44 @@ class WebSocketManager:
         await ws.send_json({"type": "connection_ack", "run_id": run_id})
 
         # ② dump any backlog (if the run already started)
-        for msg in self._buffers[run_id]:
-            await ws.send_json(msg)
+        for text in self._buffers[run_id]:
+            await ws.send_text(text)
 
     def disconnect(self, run_id: str, ws: WebSocket) -> None:
         self._conns[run_id].discard(ws)
 
     async def send_log(self, run_id: str, payload: dict) -> None:
+        if self.blob_store:
+            payload = await self.blob_store.offload(payload)
+
+        text = dumps(payload)
+
         # cache first
-        self._buffers[run_id].append(payload)
+        if payload.get("type") not in self.LIVE_ONLY_EVENTS:
+            self._buffers[run_id].append(text)
+            if self.event_log_dir:
+                self._log_event(run_id, text)
 
         # then fan-out
         stale = set()
         for ws in self._conns[run_id]:
             try:
-                await ws.send_json(payload)
+                await ws.send_text(text)
             except RuntimeError:
                 stale.add(ws)
         for ws in stale:
-            self.disconnect(run_id, ws)
\ No newline at end of file
+            self.disconnect(run_id, ws)
+
+    def _log_event(self, run_id: str, text: str) -> None:
+        writer = self._event_logs.get(run_id)
+        if writer is None:
+            self.event_log_dir.mkdir(parents=True, exist_ok=True)
+            writer = RunLogWriter(self.event_log_dir / f"{run_id}_events.jsonl", append=True)
+            self._event_logs[run_id] = writer
+        writer.write((text + "\n").encode())
+
+    async def close_run(self, run_id: str) -> None:
+        """Flush and close the run's event log (the backlog stays for late joiners)"""
+        writer = self._event_logs.pop(run_id, None)
+        if writer is not None:
+            await asyncio.to_thread(writer.close)
@@ -0,0 +1,116 @@
+"""
+clean_all_tags: five regex passes vs the linear scanner
+
+Checks that both implementations return identical output on a corpus, then
+times them on ~1 MB tag bodies:
+  tool-output - a large JSON tool result (source excerpts with '<' and '>')
+                with a few leaked markers inside strings
+  dense       - a leaked marker in every row (per-marker overhead)
+  no-end      - many opening markers and no END marker (the regex version
+                retries its DOTALL .*? pair match from every one of them, so
+                this one is size / 10: at 1 MB the regex takes minutes)
+
+The corpus is every run log given on the command line (e.g.
+logs/*_output.log, cut into tag bodies at the markers, plus each whole log)
+and randomised marker soup.
+
+Usage (from backend/):
+    python -m benchmarks.clean_tags [--size 1000000] [logs/*_output.log ...]
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.mas_bridge_tags_output import clean_all_tags  # noqa: E402
+
+ATOMS = ["<", ">", "<<<", ">>>", "<<<END_", "END_", "AGENT", "x", " ", "\n", "{", "}", '"',
+         "<<<AGENT>>>", "<<<END_AGENT>>>", "<<<EXECUTOR_TOOL_RESULT>>>", "<<<END_EXECUTOR_TOOL_RESULT>>>"]
+
+
+def legacy_clean_all_tags(text):
+    """Remove ALL tags in <<<TAG>>> format from any text"""
+    if not text:
+        return text
+    
+    # Pattern to match ANY tag: <<<ANYTHING>>> ... <<<END_ANYTHING>>>
+    # This will match nested tags, partial tags, any tag format
+    cleaned = text
+    
+    # Remove complete tag pairs: <<<TAG>>>content<<<END_TAG>>>
+    cleaned = re.sub(r'<<<[^>]+>>>.*?<<<END_[^>]+>>>', '', cleaned, flags=re.DOTALL)
+    
+    # Remove any standalone opening tags: <<<TAG>>>
+    cleaned = re.sub(r'<<<[^>]+>>>', '', cleaned)
+    
+    # Remove any standalone closing tags: <<<END_TAG>>>
+    cleaned = re.sub(r'<<<END_[^>]+>>>', '', cleaned)
+    
+    # Remove any partial tags that might be cut off: <<<... or ...>>>
+    cleaned = re.sub(r'<<<[^>]*$', '', cleaned)  # Remove incomplete opening tags at end
+    cleaned = re.sub(r'^[^<]*>>>', '', cleaned)  # Remove incomplete closing tags at start
+    
+    return cleaned.strip()
+
+
+def corpus(paths, fuzz: int, seed: int = 0):
+    for path in paths:
+        text = Path(path).read_text(encoding='utf-8', errors='ignore')
+        yield text
+        yield from re.split(r'<<<END_[A-Z_]+>>>', text)
+    rng = random.Random(seed)
+    for _ in range(fuzz):
+        yield "".join(rng.choice(ATOMS) for _ in range(rng.randint(0, 40)))
+
+
+def payloads(size: int) -> dict:
+    row = '{"file": "src/Vault.sol", "line": 42, "code": "if (balance > 0 && amount <= balance) {"},\n'
+    rows = [row] * (size // len(row))
+    for i in range(0, len(rows), len(rows) // 4):
+        rows[i] = row.replace("{\"}", "{ <<<END_AGENT>>>\"}")
+    tool_output = '{"tool_name": "slither", "status": "success", "findings": [' + "".join(rows) + ']}'
+    dense_row = '{"file": "src/Vault.sol", "line": 42, "message": "reentrancy <<<END_AGENT>>>"},\n'
+    dense = '{"findings": [' + dense_row * (size // len(dense_row)) + ']}'
+    no_end = "<<<AGENT>>> partial output " * (size // 270)
+    return {"tool-output": tool_output, "dense": dense, "no-end": no_end}
+
+
+def best_time(fn, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(paths, size: int, repeat: int, fuzz: int) -> None:
+    checked = 0
+    for text in corpus(paths, fuzz):
+        if clean_all_tags(text) != legacy_clean_all_tags(text):
+            raise SystemExit(f"output differs for {text[:200]!r}")
+        checked += 1
+    print(f"identical output on {checked} corpus entries")
+
+    print(f"{'payload':<14}{'KB':>8}{'regex ms':>12}{'scanner ms':>12}{'speedup':>10}")
+    for name, text in payloads(size).items():
+        if clean_all_tags(text) != legacy_clean_all_tags(text):
+            raise SystemExit(f"output differs for the {name} payload")
+        before = best_time(legacy_clean_all_tags, text, repeat) * 1000
+        after = best_time(clean_all_tags, text, repeat) * 1000
+        print(f"{name:<14}{len(text) // 1000:>8}{before:>12.1f}{after:>12.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("logs", nargs="*", help="recorded MAS output logs for the equivalence check")
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fuzz", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.logs, args.size, args.repeat, args.fuzz)
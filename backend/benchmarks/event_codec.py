@@ -0,0 +1,101 @@
+"""
+Event serialization: stdlib json per socket vs json_codec once per event
+
+Before, tag bodies went through json.loads and WebSocketManager.send_log
+called send_json (json.dumps) once per connected socket. Now the body is
+parsed with json_codec.loads and each event is encoded once with
+json_codec.dumps and the text is shared. A mix of MAS tag bodies (small
+tool calls, findings lists, large tool output) is parsed and the resulting
+events encoded for several sockets; the texts are checked to decode to the
+same values (orjson may spell a float differently, e.g. 0.00005 for 5e-05),
+then events/sec are reported for each.
+
+Usage (from backend/):
+    python -m benchmarks.event_codec [--events 2000] [--sockets 3] [--repeat 5]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import json_codec  # noqa: E402
+
+
+def tool_call(rng: random.Random) -> dict:
+    return {"tool_name": rng.choice(["slither", "forge_test", "read_file", "grep"]),
+            "args": {"path": f"src/Vault{rng.randint(0, 99)}.sol", "pattern": "transfer\\(",
+                     "amount": 10 ** rng.randint(3, 18)},
+            "status": "running"}
+
+
+def findings(rng: random.Random) -> dict:
+    return {"findings": [
+        {"file": "src/Vault.sol", "line": rng.randint(1, 900), "severity": rng.choice(["high", "low"]),
+         "code": "if (balance > 0) { (bool ok, ) = msg.sender.call{value: balance}(\"\"); }",
+         "confidence": rng.random()}
+        for _ in range(rng.randint(20, 200))
+    ]}
+
+
+def tool_output(rng: random.Random) -> dict:
+    lines = [f"INFO:Detectors: Vault.withdraw() ({rng.randint(0, 10 ** 6)}) sends eth to arbitrary user — ✓"
+             for _ in range(rng.randint(100, 1500))]
+    return {"tool_name": "slither", "tool_output": "\n".join(lines)}
+
+
+def corpus(events: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    makers = [tool_call] * 6 + [findings] * 2 + [tool_output] * 2
+    return [json.dumps(rng.choice(makers)(rng)) for _ in range(events)]
+
+
+def stdlib_event(body: str, sockets: int) -> list:
+    event = {"type": "executor-tool-result", "data": json.loads(body), "tag_type": "EXECUTOR_TOOL_RESULT"}
+    return [json.dumps(event, ensure_ascii=False, separators=(",", ":")) for _ in range(sockets)]
+
+
+def codec_event(body: str, sockets: int) -> list:
+    event = {"type": "executor-tool-result", "data": json_codec.loads(body), "tag_type": "EXECUTOR_TOOL_RESULT"}
+    text = json_codec.dumps(event)
+    return [text] * sockets
+
+
+def rate(fn, bodies: list, sockets: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            fn(body, sockets)
+        best = min(best, time.perf_counter() - start)
+    return len(bodies) / best
+
+
+def main(events: int, sockets: int, repeat: int) -> None:
+    if json_codec.orjson is None:
+        print("orjson is not installed; json_codec falls back to stdlib json")
+    bodies = corpus(events)
+    mismatches = [body for body in bodies
+                  if json.loads(stdlib_event(body, 1)[0]) != json.loads(codec_event(body, 1)[0])]
+    if mismatches:
+        raise SystemExit(f"encoding differs on {len(mismatches)} events, e.g. {mismatches[0][:200]!r}")
+
+    before = rate(stdlib_event, bodies, sockets, repeat)
+    after = rate(codec_event, bodies, sockets, repeat)
+    print(f"{'codec':<12}{'events/sec':>14}")
+    print(f"{'stdlib':<12}{before:>14,.0f}")
+    print(f"{'json_codec':<12}{after:>14,.0f}")
+    print(f"speedup {after / before:.1f}x over {events} events, {sockets} sockets (same values)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--sockets", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.events, args.sockets, args.repeat)
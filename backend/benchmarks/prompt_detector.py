@@ -0,0 +1,226 @@
+"""
+PromptDetector line classification: per-call regex lists vs compiled patterns
+
+The legacy detector rebuilt ~30 regex strings and ran ~30 keyword scans per
+line; PromptDetector.classify() uses one combined progress pattern and one
+combined prompt pattern. Both are run over the same synthetic MAS output
+(progress, prompts, plain text, long lines), results are checked to agree
+line by line, then lines/sec are reported for each.
+
+Usage (from backend/):
+    python -m benchmarks.prompt_detector [--lines 20000] [--repeat 5]
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.mas_bridge_tags_output import PromptDetector  # noqa: E402
+
+SAMPLES = [
+    "Enter the contract name (e.g. Vault):",
+    "Enter the specific function to analyse:",
+    "Enter hypothesis (press Enter twice when done):",
+    "▶️ Run another MAS? (y/N):",
+    "Continue? (y/N)",
+    "What is the target chain?",
+    "Which network:",
+    "Step 3:",
+    "100%:",
+    "> ",
+    "$ forge build",
+    "Please provide the RPC URL",
+    "Compiling 42 files with solc 0.8.20...",
+    "remote: Counting objects: 100% (12/12), done.",
+    "[3/10] analysing Vault.sol",
+    "=========================",
+    "-----",
+    "   ***   ",
+    "INFO: loaded 12 detectors",
+    "Planner selected executor tool slither",
+    "The withdraw function updates balances after the external call",
+    "Receiving objects:  45% (9/20)",
+    "function transfer(address to, uint256 amount) external returns (bool)",
+    "ANALYSIS SETUP",
+    "",
+    "    ",
+]
+
+
+class LegacyPromptDetector(PromptDetector):
+    """PromptDetector with the classification methods as they were"""
+
+    def is_progress_output(self, line: str) -> bool:
+        """Check if this looks like progress/status output"""
+        line_lower = line.lower().strip()
+        
+        # Common progress indicators
+        progress_patterns = [
+            r'\d+%',  # Percentage
+            r'\[\d+/\d+\]',  # [1/10] style progress
+            r'\(\d+/\d+\)',  # (1/10) style progress
+            r'\.{3,}',  # Multiple dots ...
+            r'\s{2,}\d+\s{2,}',  # Spaced numbers
+            r'^\s*\*+\s*$',  # Lines of asterisks
+            r'^\s*-+\s*$',  # Lines of dashes
+            r'^\s*=+\s*$',  # Lines of equals
+        ]
+        
+        # Check regex patterns
+        for pattern in progress_patterns:
+            if re.search(pattern, line):
+                return True
+        
+        # Check for specific keywords that indicate progress
+        progress_keywords = [
+            'remote:', 'counting', 'compressing', 'receiving', 'resolving',
+            'unpacking', 'checking', 'updating', 'downloading', 'uploading',
+            'processing', 'installing', 'building', 'compiled', 'linking',
+            'bytes', 'objects', 'deltas', 'done', 'complete', 'finished',
+            'progress', 'status', 'info:', 'debug:', 'trace:', 'warn:',
+            'writing', 'reading', 'loading', 'saving', 'fetching'
+        ]
+        
+        for keyword in progress_keywords:
+            if keyword in line_lower:
+                return True
+        
+        return False
+    
+    def is_likely_prompt(self, line: str) -> bool:
+        """Check if this line is likely a prompt for user input"""
+        if not line or len(line) > 300:
+            return False
+        
+        line_lower = line.lower().strip()
+        # if "run another mas?" in line_lower:
+        #     return True
+        if "press enter twice" in line_lower:
+            return False
+        
+        line_stripped = line.strip()
+        if not line_stripped:
+            return False
+        
+        # First, exclude progress output
+        if self.is_progress_output(line):
+            return False
+        
+        # Check if it's a repeat of a prompt we've already answered
+        if line_stripped in self.seen_prompts:
+            return False
+        
+        # Look for specific MAS prompts
+        mas_prompt_patterns = [
+            r'Enter the contract name.*:$',
+            r'Enter the specific function.*:$',
+            r'Enter hypothesis.*:$',
+            r'Enter your detailed vulnerability hypothesis.*:$',
+            r'â–¶ï¸\s*Run another MAS\?.*:$', 
+            r'Run another MAS\?.*:$',  
+            r'\(y/N\):?\s*$',  
+        ]
+        
+        # Check MAS-specific patterns first
+        for pattern in mas_prompt_patterns:
+            if re.search(pattern, line_stripped, re.IGNORECASE):
+                return True
+        
+        # Look for general question patterns
+        question_patterns = [
+            r'^.*\?\s*$',  # Ends with ?
+            r'^.*:\s*$',   # Ends with :
+            r'^>\s*',      # Starts with >
+            r'^>>>\s*',    # Python-style prompt
+            r'^\$\s*',     # Shell prompt
+            r'^Enter\s+',  # Starts with Enter
+            r'^Please\s+', # Starts with Please
+            r'^Provide\s+', # Starts with Provide
+            r'^Select\s+', # Starts with Select
+            r'^Choose\s+', # Starts with Choose
+            r'^Type\s+',   # Starts with Type
+            r'^Input\s+',  # Starts with Input
+            r'^What\s+',   # Starts with What
+            r'^Which\s+',  # Starts with Which
+            r'^Do you\s+', # Starts with Do you
+            r'^Would you\s+', # Starts with Would you
+            r'^Specify\s+', # Starts with Specify
+        ]
+        
+        # Check patterns
+        for pattern in question_patterns:
+            if re.match(pattern, line_stripped, re.IGNORECASE):
+                # Additional validation
+                if line_stripped.endswith(':'):
+                    text_before = line_stripped[:-1].strip()
+                    # Avoid matching "Step 1:" or "100%:" etc
+                    if re.match(r'^(Step\s+)?\d+$', text_before) or re.match(r'^\d+%$', text_before):
+                        return False
+                    # But DO match prompts with parentheses
+                    if "enter" in text_before.lower() or "input" in text_before.lower():
+                        return True
+                return True
+        
+        return False
+
+
+def corpus(lines: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(lines):
+        line = rng.choice(SAMPLES)
+        roll = rng.random()
+        if roll < 0.1:
+            line = line + " " + "x" * rng.randint(250, 400)
+        elif roll < 0.3:
+            line = f"{rng.randint(0, 999)} {line}"
+        out.append(line)
+    return out
+
+
+def legacy_classify(detector: LegacyPromptDetector, line: str) -> str:
+    if detector.is_likely_prompt(line):
+        return "prompt"
+    return "progress" if detector.is_progress_output(line) else "plain"
+
+
+def rate(fn, lines: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            fn(line)
+        best = min(best, time.perf_counter() - start)
+    return len(lines) / best
+
+
+def main(lines: int, repeat: int) -> None:
+    sample = corpus(lines)
+    legacy = LegacyPromptDetector()
+    compiled = PromptDetector()
+    for detector in (legacy, compiled):
+        detector.seen_prompts.add("Which network:")
+
+    mismatches = [line for line in sample if legacy_classify(legacy, line) != compiled.classify(line)]
+    if mismatches:
+        raise SystemExit(f"classification differs on {len(mismatches)} lines, e.g. {mismatches[0]!r}")
+
+    before = rate(lambda line: legacy_classify(legacy, line), sample, repeat)
+    after = rate(compiled.classify, sample, repeat)
+    print(f"{'detector':<12}{'lines/sec':>14}")
+    print(f"{'legacy':<12}{before:>14,.0f}")
+    print(f"{'compiled':<12}{after:>14,.0f}")
+    print(f"speedup {after / before:.1f}x over {lines} lines (identical results)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.lines, args.repeat)
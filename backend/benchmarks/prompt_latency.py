@@ -0,0 +1,126 @@
+"""
+Prompt latency: PIPE vs PTY transport for launch_mas_interactive
+
+A fake MAS prints some unflushed progress, then asks for input in one of two
+ways and records when it did so:
+  tagged   - prints a USER_INPUT tag with print() and reads sys.stdin
+  untagged - calls input("Enter target contract: ")
+Latency is the time from that moment until the bridge calls input_handler.
+With PIPE the child block-buffers stdout, so a tagged prompt that is never
+flushed only shows up when the trial times out.
+
+Usage (from backend/):
+    python -m benchmarks.prompt_latency [--trials 20] [--timeout 5]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import textwrap
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import mas_bridge_tags_output as bridge  # noqa: E402
+
+FAKE_MAS = textwrap.dedent('''
+    import os, sys, time
+    for i in range(20):
+        print(f"progress {i}: analysing contracts ...")
+    mode = os.environ["BENCH_PROMPT"]
+    stamp = open(os.environ["BENCH_STAMP"], "w")
+    stamp.write(repr(time.time()))
+    stamp.close()
+    if mode == "tagged":
+        print('<<<USER_INPUT>>>{"prompt": "Enter target contract:", "value": null}<<<END_USER_INPUT>>>')
+        sys.stdin.readline()
+    else:
+        input("Enter target contract: ")
+''')
+
+
+class PidRecorder:
+    """ws_manager stand-in that only remembers the MAS pid"""
+
+    def __init__(self):
+        self.pid = None
+
+    async def send_log(self, run_id, payload):
+        if payload.get("type") == "process_started":
+            self.pid = payload["data"]["pid"]
+
+
+async def trial(transport: str, prompt_mode: str, root: Path, timeout: float):
+    stamp = root / "stamp"
+    stamp.unlink(missing_ok=True)
+    os.environ["BENCH_PROMPT"] = prompt_mode
+    os.environ["BENCH_STAMP"] = str(stamp)
+    asked = asyncio.get_running_loop().create_future()
+
+    async def input_handler(prompt, *args, **kwargs):
+        if not asked.done():
+            asked.set_result(time.time())
+        return "Vault"
+
+    ws = PidRecorder()
+    run = asyncio.create_task(bridge.launch_mas_interactive(
+        "bench", {}, input_handler, ws_manager=ws, log_dir=str(root / "logs"),
+        transport=transport, console_mirror="off",
+    ))
+    try:
+        answered_at = await asyncio.wait_for(asyncio.shield(asked), timeout)
+        latency = answered_at - float(stamp.read_text())
+    except asyncio.TimeoutError:
+        # The prompt never reached the bridge; the child is stuck reading stdin
+        os.kill(ws.pid, signal.SIGKILL)
+        latency = None
+    await run
+    return latency
+
+
+async def main(trials: int, timeout: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        script = root / "src" / "api" / "agents" / "mas2.py"
+        script.parent.mkdir(parents=True)
+        script.write_text(FAKE_MAS)
+        bridge.MAS_REPO_PATH = str(root)
+        bridge.MAS_PYTHON_PATH = sys.executable
+        # The MAS inherits our environment; measure its default buffering
+        os.environ.pop("PYTHONUNBUFFERED", None)
+
+        print(f"{'transport':<10}{'prompt':<10}{'median ms':>12}{'p95 ms':>10}{'timeouts':>10}")
+        for prompt_mode in ("tagged", "untagged"):
+            for transport in ("pipe", "pty"):
+                latencies = []
+                timeouts = 0
+                for _ in range(trials):
+                    # The bridge is chatty on stdout; keep the table readable
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        latency = await trial(transport, prompt_mode, root, timeout)
+                    if latency is None:
+                        timeouts += 1
+                    else:
+                        latencies.append(latency * 1000)
+                if latencies:
+                    latencies.sort()
+                    median = f"{statistics.median(latencies):.1f}"
+                    p95 = f"{latencies[int(0.95 * (len(latencies) - 1))]:.1f}"
+                else:
+                    median = p95 = "-"
+                print(f"{transport:<10}{prompt_mode:<10}{median:>12}{p95:>10}{timeouts:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.trials, args.timeout))
@@ -0,0 +1,886 @@
+"""
+Tests for the MAS bridge output pipeline (tag scanning, decoding, line tracking)
+"""
+
+import asyncio
+import io
+import json
+import sys
+import subprocess
+import textwrap
+import time
+import types
+
+import pytest
+
+from app import json_codec
+from app import mas_bridge_tags_output as bridge
+from app.blob_store import BlobStore
+from app.event_queue import RunEventQueue
+from app.log_writer import RunLogWriter
+from app.parser_pool import ParserPool
+from app.tool_latency import ToolCallTracer, ToolLatencyStats, ToolTimingArchive
+from app.ws_manager import WebSocketManager
+from app.mas_bridge_tags_output import (
+    BoundedSet,
+    ConsoleMirror,
+    OutputDecoder,
+    OutputLineTracker,
+    OutputRingBuffer,
+    ProcessOutputBuffer,
+    PromptDetector,
+    SentinelMatcher,
+    StdinWaitProbe,
+    TagAwareOutputBuffer,
+    TagScanner,
+    ToolLoopDetector,
+)
+
+
+class FakeWSManager:
+    """Collects everything the bridge would send to WebSocket clients"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def send_log(self, run_id, payload):
+        self.messages.append(payload)
+
+
+def scan(chunks, binary=False):
+    scanner = TagScanner(binary=binary)
+    events = []
+    for chunk in chunks:
+        events.extend(scanner.feed(chunk))
+    events.extend(scanner.flush())
+    return [(event, tag, bytes(value) if binary and value is not None else value)
+            for event, tag, value in events]
+
+
+def feed_buffer(chunks, binary=False, **kwargs):
+    ws = FakeWSManager()
+    output_buffer = TagAwareOutputBuffer(ws, "run", binary=binary, **kwargs)
+
+    async def run():
+        for chunk in chunks:
+            await output_buffer.add_chunk(chunk)
+
+    asyncio.run(run())
+    return ws.messages, output_buffer
+
+
+def test_scanner_marker_split_across_chunks():
+    events = scan(["before <<<AG", "ENT>>>hello<<<END_", "AGENT>>> after"])
+    assert events == [
+        ('text', None, "before "),
+        ('start', 'AGENT', None),
+        ('content', 'AGENT', "hello"),
+        ('end', 'AGENT', None),
+        ('text', None, " after"),
+    ]
+
+
+def test_scanner_holds_back_trailing_angle_brackets():
+    scanner = TagScanner()
+    assert scanner.feed("text<") == [('text', None, "text")]
+    assert scanner.feed("<") == []
+    assert scanner.feed("<SYSTEM>>>x") == [('start', 'SYSTEM', None), ('content', 'SYSTEM', "x")]
+
+
+def test_scanner_releases_held_back_text_on_flush():
+    scanner = TagScanner()
+    assert scanner.feed("tail <<<AGE") == [('text', None, "tail ")]
+    assert scanner.flush() == [('text', None, "<<<AGE")]
+
+
+def test_scanner_nested_start_marker_opens_new_tag():
+    events = scan(["<<<AGENT>>>a<<<SYSTEM>>>b<<<END_SYSTEM>>>"])
+    assert events == [
+        ('start', 'AGENT', None),
+        ('content', 'AGENT', "a"),
+        ('start', 'SYSTEM', None),
+        ('content', 'SYSTEM', "b"),
+        ('end', 'SYSTEM', None),
+    ]
+
+
+def test_scanner_ignores_end_marker_of_other_tag():
+    events = scan(["<<<AGENT>>>a<<<END_SYSTEM>>>b<<<END_AGENT>>><<<END_AGENT>>>"])
+    assert events == [
+        ('start', 'AGENT', None),
+        ('content', 'AGENT', "a<<<END_SYSTEM>>>b"),
+        ('end', 'AGENT', None),
+        ('text', None, "<<<END_AGENT>>>"),
+    ]
+
+
+def test_scanner_binary_mode_matches_text_mode():
+    text = "x <<<AGENT>>>{\"k\": \"▶️ <b>\"}<<<END_AGENT>>> y"
+    data = text.encode()
+    chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+    binary = scan(chunks, binary=True)
+    joined = []
+    for event, tag, value in binary:
+        if joined and value is not None and joined[-1][0] == event and joined[-1][2] is not None:
+            joined[-1] = (event, tag, joined[-1][2] + value)
+        else:
+            joined.append((event, tag, value))
+    assert [(e, t, v.decode() if v is not None else None) for e, t, v in joined] == scan([text])
+
+
+def test_output_buffer_keeps_angle_brackets_in_tag_body():
+    messages, _ = feed_buffer(['<<<AGENT>>>{"content": "a < b"}<<<END_AGENT>>>'], delta_ms=60_000)
+    assert [m["type"] for m in messages] == ["stream_start", "stream_delta", "agent", "stream_end"]
+    assert messages[2]["data"] == {"content": "a < b"}
+
+
+def test_output_buffer_binary_decodes_codepoint_split_across_chunks():
+    data = '<<<AGENT>>>{"content": "▶️ ─"}<<<END_AGENT>>>'.encode()
+    split = data.index("▶".encode()) + 1
+    messages, _ = feed_buffer([data[:split], data[split:]], binary=True)
+    messages = [m for m in messages if m["type"] != "stream_delta"]
+    assert messages[1]["data"] == {"content": "▶️ ─"}
+
+
+def test_output_buffer_streams_tag_content_as_deltas():
+    body = '{"content": "' + "x" * 20 + '"}'
+    chunks = ["<<<AGENT>>>"] + [body[i:i + 6] for i in range(0, len(body), 6)] + ["<<<END_AGENT>>>"]
+    messages, _ = feed_buffer(chunks, delta_chars=10, delta_ms=60_000)
+    deltas = [m for m in messages if m["type"] == "stream_delta"]
+    assert len(deltas) > 1
+    assert all(m["stream_id"] == "stream_1" and m["tag_type"] == "AGENT" for m in deltas)
+    assert "".join(m["data"]["content"] for m in deltas) == body
+    assert [m["type"] for m in messages][-2:] == ["agent", "stream_end"]
+    assert messages[-2]["data"] == {"content": "x" * 20}
+
+
+def test_output_buffer_streams_top_level_fields_before_tag_ends():
+    body = ('{"tool_name": "slither \\"x\\"", "args": {"path": "a}b", "flags": ["-v", "{"]}, '
+            '"note": "skip, me", "status": "running", "tool_output": "' + "y" * 50 + '"}')
+    chunks = ["<<<EXECUTOR_TOOL_CALL>>>"] + [body[i:i + 7] for i in range(0, len(body), 7)]
+    messages, _ = feed_buffer(chunks, delta_chars=10 ** 6, delta_ms=10 ** 6)
+
+    assert [m["data"] for m in messages if m["type"] == "stream_field"] == [
+        {"field": "tool_name", "value": 'slither "x"'},
+        {"field": "args", "value": {"path": "a}b", "flags": ["-v", "{"]}},
+        {"field": "status", "value": "running"},
+    ]
+    # Nothing but fields went out before the end marker
+    assert all(m["type"] in ("stream_start", "stream_field") for m in messages)
+
+    messages, _ = feed_buffer(["<<<AGENT>>>", "plain {\"status\": 1}<<<END_AGENT>>>"])
+    assert not [m for m in messages if m["type"] == "stream_field"]
+
+
+def test_output_buffer_user_input_sets_pending_prompt():
+    messages, output_buffer = feed_buffer(
+        ['<<<USER_INPUT>>>{"prompt": "Run another MAS? (y/N):", "value": null}<<<END_USER_INPUT>>>']
+    )
+    assert output_buffer.needs_input
+    assert output_buffer.pending_prompt == "Run another MAS? (y/N):"
+    assert {"type": "prompt", "data": {"prompt": "Run another MAS? (y/N):", "multiline": False}} in messages
+
+
+def test_process_output_buffer_matches_inline_parsing():
+    data = ('noise <<<AGENT>>>{"content": "▶️ a"}<<<END_AGENT>>>\n'
+            '<<<USER_INPUT>>>{"prompt": "Run another MAS? (y/N):", "value": null}<<<END_USER_INPUT>>>').encode()
+    chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+    inline, inline_buffer = feed_buffer(chunks, binary=True)
+
+    async def run():
+        ws = FakeWSManager()
+        output_buffer = ProcessOutputBuffer(pool, ws, "run")
+        await output_buffer.open()
+        for chunk in chunks:
+            await output_buffer.add_chunk(chunk)
+        prompt = output_buffer.pending_prompt
+        await output_buffer.force_flush()
+        return ws.messages, prompt
+
+    pool = ParserPool(1)
+    try:
+        remote, prompt = asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+    def strip(messages):
+        return [m for m in messages if m["type"] != "stream_delta"]
+
+    assert strip(remote) == strip(inline)
+    assert prompt == inline_buffer.pending_prompt == "Run another MAS? (y/N):"
+
+
+def test_parser_pool_fails_calls_to_dead_worker_while_others_busy():
+    async def run():
+        await pool.open("dead")
+        await pool.open("busy")
+        pool._processes[0].kill()
+        pool._processes[0].join()
+        stop = asyncio.Event()
+
+        async def keep_busy():
+            while not stop.is_set():
+                await pool.call("busy", "delta")
+
+        busy = asyncio.create_task(keep_busy())
+        try:
+            with pytest.raises(RuntimeError, match="died"):
+                await asyncio.wait_for(pool.call("dead", "delta"), timeout=5)
+        finally:
+            stop.set()
+            await busy
+
+    pool = ParserPool(2)
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+
+def test_clean_all_tags_matches_regex_passes():
+    cases = {
+        '{"content": "a <<<END_AGENT>>> b"}': '{"content": "a  b"}',
+        "x<<<A>>>inner<<<END_A>>>y<<<B>>>z": "xyz",
+        "keep <<<OPEN>>> no end": "keep  no end",
+        "tail <<<PARTIAL": "tail",
+        "END_X>>> head": "head",
+        # Pair removal joins "<<<...>" and ">>>" into a marker the next pass strips
+        '<<<"END_><<<A>>>A<<<<END_A>>>>>>': ">",
+        # Markers never complete: kept, and found in linear time
+        "<<<" * 1000 + ">": "<<<" * 1000 + ">",
+    }
+    for text, expected in cases.items():
+        assert bridge.clean_all_tags(text) == expected
+
+
+def test_output_decoder_keeps_split_codepoint():
+    decoder = OutputDecoder()
+    data = "a▶b".encode()
+    assert decoder.decode(data[:2]) == "a"
+    assert decoder.decode(data[2:]) == "▶b"
+    assert decoder.flush() == ""
+
+
+def test_prompt_detector_classifies_in_one_pass():
+    detector = PromptDetector()
+    detector.seen_prompts.add("Which network:")
+    assert [detector.classify(line) for line in [
+        "Enter the contract name (e.g. Vault):",
+        "▶️ Run another MAS? (y/N):",
+        "What is the target chain?",
+        "Step 3:",
+        "Compiling 42 files...",
+        "INFO: loaded 12 detectors",
+        "=====",
+        "Which network:",
+        "Enter hypothesis (press Enter twice when done):",
+        "The withdraw function updates balances",
+        "What " + "x" * 300,
+    ]] == ["prompt", "prompt", "prompt", "plain", "progress", "progress", "progress",
+           "plain", "progress", "plain", "plain"]
+    assert detector.is_likely_prompt("Continue? (y/N)")
+    assert detector.is_progress_output("Receiving objects:  45% (9/20)")
+
+
+def test_prompt_detector_state_stays_bounded():
+    seen = BoundedSet(3)
+    for prompt in ["a", "b", "c"]:
+        seen.add(prompt)
+    assert "a" in seen      # refreshes "a", so "b" is now the oldest
+    seen.add("d")
+    assert list(seen) == ["c", "a", "d"]
+
+    detector = PromptDetector(max_history=5, max_seen=4)
+    for i in range(1000):
+        detector.add_line(f"line {i}")
+        detector.seen_prompts.add(f"Enter value {i}:")
+    assert list(detector.recent_lines) == [f"line {i}" for i in range(995, 1000)]
+    assert detector.last_lines(2) == ["line 998", "line 999"]
+    assert detector.last_lines(9) == list(detector.recent_lines)
+    assert len(detector.seen_prompts) == 4
+
+
+def test_line_tracker_matches_per_character_loop():
+    text = "abc\nRun another MAS? \n\nEnter x:\n  \n▶️ tail"
+    detector = PromptDetector()
+    tracker = OutputLineTracker(detector)
+    data = text.encode()
+    for i in range(0, len(data), 3):
+        tracker.feed(data[i:i + 3])
+
+    reference = PromptDetector()
+    buffer = ""
+    for char in text:
+        buffer += char
+        if char == '\n':
+            if buffer.strip():
+                reference.add_line(buffer.strip())
+            if "Run another MAS?" not in buffer:
+                buffer = ""
+
+    assert detector.recent_lines == reference.recent_lines
+    assert tracker.text() == buffer
+
+
+def test_ring_buffer_keeps_last_capacity_bytes():
+    ring = OutputRingBuffer(8)
+    ring.write(b"abc")
+    assert ring.tail() == b"abc"
+    ring.write(b"defghij")
+    assert ring.tail() == b"cdefghij"
+    assert ring.tail(3) == b"hij"
+    ring.write(b"0123456789")
+    assert ring.tail() == b"23456789"
+    assert len(ring) == 8
+
+
+def test_sentinel_matcher_finds_match_split_across_chunks():
+    data = b"xxGRAPH_RECURSION_LIMITyy"
+    for split in range(len(data) + 1):
+        for second in range(split, len(data) + 1):
+            matcher = SentinelMatcher()
+            cuts = [matcher.feed(part) for part in (data[:split], data[split:second], data[second:])]
+            hits = [(i, cut) for i, cut in enumerate(cuts) if cut != -1]
+            assert len(hits) == 1
+            index, cut = hits[0]
+            offset = (0, split, second)[index]
+            assert offset + cut == data.index(b"LIMIT") + len(b"LIMIT")
+
+
+def test_log_writer_flushes_on_size_time_and_close(tmp_path):
+    path = tmp_path / "run.log"
+    writer = RunLogWriter(path, flush_bytes=4, flush_interval=60)
+    writer.write(b"ab")
+    writer.write(b"cd")
+    deadline = time.time() + 2
+    while path.read_bytes() != b"abcd" and time.time() < deadline:
+        time.sleep(0.01)
+    assert path.read_bytes() == b"abcd"
+
+    writer.flush_interval = 0.01
+    writer.write(b"e")
+    deadline = time.time() + 2
+    while path.read_bytes() != b"abcde" and time.time() < deadline:
+        time.sleep(0.01)
+    assert path.read_bytes() == b"abcde"
+
+    writer.flush_interval = 60
+    writer.write(b"f")
+    writer.close()
+    assert path.read_bytes() == b"abcdef"
+    assert writer.bytes_written == 6
+
+
+def test_log_handle_reads_lines_through_index(tmp_path):
+    lines = [f"line {i}\n".encode() for i in range(50)]
+    writer = RunLogWriter(tmp_path / "run.log", flush_bytes=7, index_every=4)
+    for chunk in [b"".join(lines)[i:i + 11] for i in range(0, len(b"".join(lines)), 11)]:
+        writer.write(chunk)
+    writer.write(b"partial")
+    writer.close()
+
+    log = writer.handle()
+    data = b"".join(lines) + b"partial"
+    assert (log.size, log.line_count) == (len(data), 50)
+    assert log.line_offsets == [data.index(b"line %d\n" % i) for i in range(0, 50, 4)]
+    assert list(log.lines(9, 3)) == ["line 9\n", "line 10\n", "line 11\n"]
+    assert list(log.lines(48)) == ["line 48\n", "line 49\n", "partial"]
+    assert list(log.lines(60)) == []
+    assert log.read(7, 7) == b"line 1\n"
+    assert log.tail(8) == b"\npartial"
+    assert log.text() == data.decode()
+
+
+def test_console_mirror_modes():
+    chunks = [b"l0\nl1", b"\nl2\nl3\nl4", b"\npartial"]
+
+    def mirrored(mode, **kwargs):
+        stream = io.BytesIO()
+        mirror = ConsoleMirror(mode, stream=stream, **kwargs)
+        for chunk in chunks:
+            mirror.write(chunk)
+        mirror.tag("AGENT", {"data": {"content": "hi"}})
+        mirror.flush()
+        return stream.getvalue()
+
+    assert mirrored("off") == b""
+    assert mirrored("line") == b"l0\nl1\nl2\nl3\nl4\npartial"
+    assert mirrored("sampled", sample_every=2) == b"l0\nl2\nl4\n"
+    assert mirrored("tagged") == b'[AGENT] {"content": "hi"}\n'
+
+
+class SlowWSManager(FakeWSManager):
+    """Client that only receives once released"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def send_log(self, run_id, payload):
+        await self.release.wait()
+        self.messages.append(payload)
+
+
+def run_event_queue(policy, payloads, tmp_path, capacity=2):
+    async def run():
+        ws = SlowWSManager()
+        events = RunEventQueue(ws, "run", capacity=capacity, overflow_policy=policy, spill_dir=str(tmp_path))
+        for payload in payloads:
+            await events.send_log("run", payload)
+        stats = events.stats()
+        ws.release.set()
+        await events.close()
+        return ws.messages, stats
+
+    return asyncio.run(run())
+
+
+def delta(stream_id, content):
+    return {"type": "stream_delta", "stream_id": stream_id, "tag_type": "AGENT", "data": {"content": content}}
+
+
+def test_event_queue_coalesces_deltas_when_full(tmp_path):
+    payloads = [{"type": "stream_start", "stream_id": "s1"}, delta("s1", "a"), delta("s1", "b"),
+                delta("s1", "c"), {"type": "stream_end", "stream_id": "s1"}]
+    messages, stats = run_event_queue("coalesce", payloads, tmp_path)
+    assert [m["type"] for m in messages] == ["stream_start", "stream_delta", "stream_end"]
+    assert "".join(m["data"]["content"] for m in messages if m["type"] == "stream_delta") == "abc"
+    assert stats["coalesced"] == 2 and stats["dropped"] == 0
+    assert stats["spilled"] == 1  # stream_end didn't fit
+
+
+def test_event_queue_spills_tags_past_capacity_under_coalesce(tmp_path):
+    payloads = [{"type": "agent", "n": n} for n in range(6)] + [delta("s1", "late")]
+    messages, stats = run_event_queue("coalesce", payloads, tmp_path)
+    assert messages == payloads[:6]
+    assert (stats["queued"], stats["spilled"], stats["dropped"]) == (6, 4, 1)
+
+
+def test_event_queue_drops_progress_but_keeps_other_events(tmp_path):
+    payloads = [{"type": "stream_start", "stream_id": "s1"}, delta("s1", "a"), delta("s1", "b"),
+                {"type": "agent", "stream_id": "s1"}, {"type": "stream_end", "stream_id": "s1"}]
+    messages, stats = run_event_queue("drop_progress", payloads, tmp_path)
+    assert [m["type"] for m in messages] == ["stream_start", "agent", "stream_end"]
+    assert stats["dropped"] == 2
+
+
+def test_event_queue_spills_to_disk_in_order(tmp_path):
+    payloads = [{"type": "log", "n": n} for n in range(10)]
+    messages, stats = run_event_queue("spill", payloads, tmp_path)
+    assert messages == payloads
+    assert stats["spilled"] == 8
+    assert not list(tmp_path.glob("*.spill.jsonl"))
+
+
+def write_fake_mas(tmp_path, monkeypatch, source):
+    script = tmp_path / "src" / "api" / "agents" / "mas2.py"
+    script.parent.mkdir(parents=True)
+    script.write_text(textwrap.dedent(source))
+    monkeypatch.setattr(bridge, "MAS_REPO_PATH", str(tmp_path))
+    monkeypatch.setattr(bridge, "MAS_PYTHON_PATH", sys.executable)
+
+
+def test_ws_manager_offloads_oversized_payload_strings(tmp_path):
+    store = BlobStore(tmp_path / "blobs", threshold=10, preview_chars=4)
+    manager = WebSocketManager(blob_store=store, event_log_dir=tmp_path / "events")
+    result = {"type": "executor-tool-result",
+              "data": {"tool_name": "slither", "tool_output": "ÿ" + "x" * 20}}
+    partial = {"type": "incomplete_tag", "partial_content": "y" * 11}
+    nested = {"type": "analysis", "data": {"findings": [{"line": 1, "code": "z" * 12}, {"code": "short"}]}}
+
+    async def send():
+        for payload in (result, partial, result, nested):
+            await manager.send_log("run", payload)
+        await manager.close_run("run")
+
+    asyncio.run(send())
+    backlog = list(manager._buffers["run"])
+    logged = (tmp_path / "events" / "run_events.jsonl").read_text().splitlines()
+    assert logged == backlog
+    first, second, third, fourth = map(json.loads, backlog)
+
+    digest = store.put(("ÿ" + "x" * 20).encode())
+    assert first == third == {"type": "executor-tool-result", "data": {
+        "tool_name": "slither",
+        "tool_output": "ÿxxx",
+        "blobs": {"tool_output": {"digest": digest, "size": 22, "content_type": "text/plain; charset=utf-8"}},
+    }}
+    assert second["partial_content"] == "yyyy"
+    assert store.get(second["blobs"]["partial_content"]["digest"]) == b"y" * 11
+    assert fourth["data"]["findings"] == [{"line": 1, "code": "zzzz"}, {"code": "short"}]
+    assert store.get(fourth["data"]["blobs"]["findings.0.code"]["digest"]) == b"z" * 12
+    # The producer's payload is left alone, and identical bodies share one file
+    assert result["data"]["tool_output"] == "ÿ" + "x" * 20
+    assert nested["data"]["findings"][0]["code"] == "z" * 12
+    assert len(list((tmp_path / "blobs").rglob("*"))) == 6
+    assert store.dedupe_hits == 2
+    assert store.path("../../etc/passwd") is None
+
+
+def test_ws_manager_keeps_stream_chunks_out_of_backlog_and_log(tmp_path):
+    manager = WebSocketManager(event_log_dir=tmp_path)
+    events = [{"type": "stream_start", "stream_id": "s1", "tag_type": "AGENT"}]
+    events += [{"type": "stream_delta", "stream_id": "s1", "data": {"content": "x" * 10}}] * 3
+    events += [{"type": "stream_field", "stream_id": "s1", "data": {"field": "tool", "value": "grep"}}]
+    events += [{"type": "agent", "data": {"content": "x" * 30}, "stream_id": "s1", "stream_complete": True},
+               {"type": "stream_end", "stream_id": "s1"}]
+
+    async def send():
+        for payload in events:
+            await manager.send_log("run", payload)
+        await manager.close_run("run")
+
+    asyncio.run(send())
+    backlog = list(manager._buffers["run"])
+    assert [json.loads(text)["type"] for text in backlog] == ["stream_start", "agent", "stream_end"]
+    assert (tmp_path / "run_events.jsonl").read_text().splitlines() == backlog
+
+
+def test_json_codec_keeps_stdlib_results():
+    text = '{"amount": 115792089237316195423570985008687907853269984665640564039457584007913129639935, ' \
+           '"low": -9223372036854775809, "ratio": 0.5, "name": "caf\\u00e9", "bad": NaN}'
+    data = json_codec.loads(text)
+    assert data["amount"] == 2 ** 256 - 1 and data["low"] == -2 ** 63 - 1
+    assert data["name"] == "café" and data["bad"] != data["bad"]
+    assert json_codec.loads(b'{"x": [1, "\\ud800"]}') == {"x": [1, "\ud800"]}
+    with pytest.raises(json_codec.JSONDecodeError):
+        json_codec.loads('{"x": ')
+    # Same text Starlette's send_json produced, big integers included
+    payload = {"type": "log", "data": {"line": "é", "amount": 2 ** 70}}
+    assert json_codec.dumps(payload) == json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def test_blob_store_never_reuses_a_colliding_digest(tmp_path, monkeypatch):
+    store = BlobStore(tmp_path)
+    monkeypatch.setattr(BlobStore, "digest", staticmethod(lambda body: "0" * 32))
+    first = store.put(b"first body")
+    second = store.put(b"other body")
+    assert first == "0" * 32 and len(second) == 64
+    assert (store.get(first), store.get(second)) == (b"first body", b"other body")
+
+
+def test_blob_endpoint_serves_ranges(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    store = BlobStore(tmp_path / "blobs")
+    monkeypatch.setattr(main, "blob_store", store)
+    digest = store.put(b"0123456789")
+    client = TestClient(main.app)
+
+    assert client.get(f"/blobs/{digest}").content == b"0123456789"
+    ranged = client.get(f"/blobs/{digest}", headers={"Range": "bytes=2-5"})
+    assert ranged.status_code == 206
+    assert ranged.content == b"2345"
+    assert client.get("/blobs/" + "0" * 32).status_code == 404
+
+
+def test_tool_tracer_pairs_calls_with_results(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main, tool_latency
+
+    clock = iter([0.0, 0.5, 2.0, 2.75, 4.0, 5.0, 5.0, 5.0])
+    monkeypatch.setattr(tool_latency, "time", types.SimpleNamespace(monotonic=lambda: next(clock)))
+    stats = ToolLatencyStats()
+    tracer = ToolCallTracer(on_record=stats.add)
+    monkeypatch.setattr(main, "tool_tracers", {"run": tracer})
+    monkeypatch.setattr(main, "tool_latency", stats)
+
+    def tag(tag_type, **data):
+        tracer.tag(tag_type, {"data": data})
+
+    tag("EXECUTOR_TOOL_CALL", tool_name="slither", args={"path": "src"})     # t=0
+    tag("EXECUTOR_TOOL_CALL", tool_name="grep", args={"pattern": "call"})    # t=0.5
+    tag("EXECUTOR_TOOL_RESULT", tool_name="grep", tool_output="x" * 2000)    # t=2
+    tag("EXECUTOR_TOOL_RESULT", tool_output="done")                          # t=2.75, oldest open call
+    tag("EXECUTOR_TOOL_CALL", tool_name="grep", args={})                     # t=4, never answered
+    tag("EXECUTOR_TOOL_RESULT", tool_name="forge_test", tool_output="")
+
+    client = TestClient(main.app)
+    table = client.get("/runs/run/tool-timings").json()
+    assert [(c["tool_name"], c["latency_ms"]) for c in table["calls"]] == [("grep", 1500.0), ("slither", 2750.0)]
+    assert table["calls"][0]["result_bytes"] > 2000
+    assert [t["tool_name"] for t in table["tools"]] == ["slither", "grep"]
+    assert (table["open_calls"], table["unmatched_results"]) == (1, 1)
+    assert client.get("/runs/other/tool-timings").status_code == 404
+
+    # Unanswered calls are capped per tool; finished runs move to the archive
+    capped = ToolCallTracer(max_open=2)
+    for _ in range(3):
+        capped.tag("EXECUTOR_TOOL_CALL", {"data": {"tool_name": "ping"}})
+    assert (capped.open_calls, capped.evicted_calls) == (2, 1)
+    archive = ToolTimingArchive(maxsize=1)
+    archive.put("old", {"calls": []})
+    archive.put("run", table)
+    assert archive.get("old") is None and archive.get("run") == table
+    monkeypatch.setattr(main, "tool_tracers", {})
+    monkeypatch.setattr(main, "tool_timings", archive)
+    assert client.get("/runs/run/tool-timings").json()["calls"] == table["calls"]
+
+    grep = client.get("/system/tool-latency").json()["tools"][1]
+    assert grep["calls"] == 1 and grep["p50_ms"] == 2500
+    assert {"le": 2500, "count": 1} in grep["latency_histogram_ms"]
+    assert {"le": 4096, "count": 1} in grep["result_size_histogram_bytes"]
+
+
+def test_user_input_answered_while_output_keeps_flowing(tmp_path, monkeypatch):
+    write_fake_mas(tmp_path, monkeypatch, '''
+        import sys, threading, time
+        print('<<<USER_INPUT>>>{"prompt": "Continue?", "value": null}<<<END_USER_INPUT>>>', flush=True)
+        answered = threading.Event()
+        def heartbeat():
+            while not answered.is_set():
+                print("working...", flush=True)
+                time.sleep(0.02)
+        threading.Thread(target=heartbeat, daemon=True).start()
+        answer = input()
+        answered.set()
+        print(f'<<<SYSTEM>>>{{"message": "got {answer}"}}<<<END_SYSTEM>>>', flush=True)
+    ''')
+    prompts = []
+
+    async def answer(prompt):
+        prompts.append(prompt)
+        return "yes"
+
+    ws = FakeWSManager()
+    result = asyncio.run(asyncio.wait_for(bridge.launch_mas_interactive(
+        "run", {}, answer, ws_manager=ws, log_dir=str(tmp_path / "logs")
+    ), timeout=10))
+
+    assert result["success"]
+    assert prompts == ["Continue?"]
+    assert {"message": "got yes"} in [m.get("data") for m in ws.messages]
+
+
+def test_stall_watchdog_spares_input_wait_and_kills_silent_run(tmp_path, monkeypatch):
+    from app import main
+    monkeypatch.setattr(main, "ws_manager", FakeWSManager())
+    write_fake_mas(tmp_path, monkeypatch, '''
+        import time
+        print('<<<USER_INPUT>>>{"prompt": "Continue?", "value": null}<<<END_USER_INPUT>>>', flush=True)
+        input()
+        print("analysing...", flush=True)
+        time.sleep(30)
+    ''')
+    manager = main.RunManager()
+    pids = []
+    progress = bridge.RunProgress(on_process_started=pids.append)
+
+    async def answer(prompt):
+        await asyncio.sleep(1)  # the user takes longer than the stall timeout
+        return "y"
+
+    async def run():
+        run_task = asyncio.create_task(bridge.launch_mas_interactive(
+            "run", {}, answer, log_dir=str(tmp_path / "logs"), progress=progress
+        ))
+        await manager.watch_stall("run", progress, run_task, timeout=0.4, grace=5)
+        return await run_task
+
+    started = time.monotonic()
+    result = asyncio.run(asyncio.wait_for(run(), timeout=10))
+    assert progress.stalled and not result["success"]
+    assert pids == [progress.pid]
+    assert 1.4 < time.monotonic() - started < 5
+    assert "analysing..." in result["log"].text()
+    assert main.ws_manager.messages[0]["type"] == "error"
+
+
+def test_tool_loop_detector_terminates_repeating_agent(tmp_path, monkeypatch):
+    detector = ToolLoopDetector(repeats=3)
+    for args in ({"path": "A.sol"}, {"path": "B.sol"}, {"path": "A.sol"}, {"path": " A.sol "}):
+        detector.tag("EXECUTOR_TOOL_CALL", {"data": {"tool_name": "read_file", "args": args}})
+    assert detector.take() is None and detector.count == 2
+
+    write_fake_mas(tmp_path, monkeypatch, '''
+        import os, signal, sys, time
+        # A MAS that exits cleanly on SIGTERM, or one that ignores it
+        if os.environ["FAKE_SIGTERM"] == "exit0":
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        else:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        calls = ['{"tool_name": "grep", "args": {"pattern": "call", "path": "src"}}',
+                 '{"args": {"path": "src", "pattern": "call"}, "tool_name": "grep"}']
+        for i in range(8):
+            print("<<<EXECUTOR_TOOL_CALL>>>" + calls[i % 2] + "<<<END_EXECUTOR_TOOL_CALL>>>", flush=True)
+            print('<<<EXECUTOR_TOOL_RESULT>>>{"tool_name": "grep", "tool_output": "x"}<<<END_EXECUTOR_TOOL_RESULT>>>', flush=True)
+        time.sleep(30)
+    ''')
+    monkeypatch.setattr(bridge, "MAS_TOOL_LOOP_KILL_GRACE", 0.5)
+
+    async def no_input(prompt):
+        return None
+
+    def run(on_sigterm):
+        monkeypatch.setenv("FAKE_SIGTERM", on_sigterm)
+        ws = FakeWSManager()
+        result = asyncio.run(asyncio.wait_for(bridge.launch_mas_interactive(
+            "run", {}, no_input, ws_manager=ws, log_dir=str(tmp_path / "logs"), tool_loop_action="terminate"
+        ), timeout=10))
+        return result, ws.messages
+
+    result, messages = run("exit0")
+    assert result["exit_code"] == 0 and not result["success"]
+    assert result["tool_loop"]["tool_name"] == "grep" and result["tool_loop"]["action"] == "terminate"
+    assert "agent loop" in result["error"]
+    alerts = [m for m in messages if m.get("type") == "tool_loop"]
+    assert len(alerts) == 1 and alerts[0]["data"]["repeats"] == 5
+
+    result, _ = run("ignore")
+    assert result["exit_code"] == -9 and not result["success"]
+
+
+def test_stdin_wait_probe_sees_blocked_read():
+    reader = subprocess.Popen([sys.executable, "-c", "input()"], stdin=subprocess.PIPE)
+    sleeper = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)"], stdin=subprocess.PIPE)
+    try:
+        probe = StdinWaitProbe(reader.pid)
+        if not probe.available:
+            pytest.skip("/proc syscall probing not available")
+        deadline = time.time() + 5
+        while not probe.waiting_for_input() and time.time() < deadline:
+            time.sleep(0.02)
+        assert probe.waiting_for_input() is True
+        # never seen reading stdin: unknown, so the output heuristics decide
+        assert StdinWaitProbe(sleeper.pid).waiting_for_input() is None
+    finally:
+        reader.kill()
+        sleeper.kill()
+        reader.wait()
+        sleeper.wait()
+
+
+def test_stdin_wait_probe_sees_grandchild_read():
+    # a wrapper (like `conda run`) that leaves reading stdin to its own child
+    wrapper = subprocess.Popen(
+        [sys.executable, "-c", f"import subprocess; subprocess.run([{sys.executable!r}, '-c', 'input()'])"],
+        stdin=subprocess.PIPE,
+    )
+    try:
+        probe = StdinWaitProbe(wrapper.pid)
+        if not probe.available:
+            pytest.skip("/proc syscall probing not available")
+        probe.PROC_SCAN_SECONDS = 0
+        deadline = time.time() + 5
+        while not probe.waiting_for_input() and time.time() < deadline:
+            time.sleep(0.02)
+        assert probe.waiting_for_input() is True
+        wrapper.stdin.write(b"x\n")
+        wrapper.stdin.flush()
+        wrapper.wait(timeout=5)
+        assert probe.waiting_for_input() is False  # gone, after a read was seen
+    finally:
+        wrapper.kill()
+        wrapper.wait()
+
+
+def test_untagged_prompt_surfaces_only_when_child_reads_stdin(tmp_path, monkeypatch):
+    if not StdinWaitProbe(1).available:
+        pytest.skip("/proc syscall probing not available")
+    write_fake_mas(tmp_path, monkeypatch, '''
+        import time
+        print("Looks like a question?", flush=True)
+        time.sleep(0.5)
+        name = input("Contract name: ")
+        print(f'<<<SYSTEM>>>{{"message": "got {name}"}}<<<END_SYSTEM>>>', flush=True)
+    ''')
+    prompts = []
+
+    async def answer(prompt):
+        prompts.append(prompt)
+        return "Vault"
+
+    ws = FakeWSManager()
+    result = asyncio.run(asyncio.wait_for(bridge.launch_mas_interactive(
+        "run", {}, answer, ws_manager=ws, log_dir=str(tmp_path / "logs")
+    ), timeout=10))
+
+    assert result["success"]
+    assert prompts == ["Contract name:"]
+    assert {"message": "got Vault"} in [m.get("data") for m in ws.messages]
+
+
+def test_pty_transport_delivers_unflushed_output(tmp_path, monkeypatch):
+    if not bridge.PTY_AVAILABLE:
+        pytest.skip("pty not available")
+    monkeypatch.delenv("PYTHONUNBUFFERED", raising=False)
+    write_fake_mas(tmp_path, monkeypatch, '''
+        import sys
+        print('<<<USER_INPUT>>>{"prompt": "Target?", "value": null}<<<END_USER_INPUT>>>')
+        answer = sys.stdin.readline().strip()
+        print(f'<<<SYSTEM>>>{{"message": "got {answer}"}}<<<END_SYSTEM>>>')
+        print("a\\nb")
+    ''')
+
+    async def answer(prompt):
+        return "x" * 5000
+
+    ws = FakeWSManager()
+    result = asyncio.run(asyncio.wait_for(bridge.launch_mas_interactive(
+        "run", {}, answer, ws_manager=ws, log_dir=str(tmp_path / "logs"), transport="pty"
+    ), timeout=10))
+
+    assert result["success"]
+    assert {"message": "got " + "x" * 5000} in [m.get("data") for m in ws.messages]
+    # No echo of the input and no \r\n translation in the log
+    output = result["log"].text()
+    assert output.endswith("<<<END_SYSTEM>>>\na\nb\n")
+    assert "x" * 5000 not in output.split("<<<SYSTEM>>>")[0]
+
+
+def test_event_channel_replaces_stdout_tags(tmp_path, monkeypatch):
+    write_fake_mas(tmp_path, monkeypatch, '''
+        import json, os, sys
+        channel = os.fdopen(int(os.environ["SHEPHERD_EVENT_FD"]), "w", buffering=1)
+        def emit(tag, data):
+            channel.write(json.dumps({"tag": tag, "data": data}) + "\\n")
+        emit("AGENT", {"content": "text with <<<END_AGENT>>> inside"})
+        print('<<<SYSTEM>>>{"message": "stdout tags are plain logs now"}<<<END_SYSTEM>>>', flush=True)
+        emit("USER_INPUT", {"prompt": "Target?", "value": None})
+        answer = sys.stdin.readline().strip()
+        channel.write("not json\\n")
+        emit("SYSTEM", {"message": f"got {answer}"})
+    ''')
+
+    async def answer(prompt):
+        return "Vault"
+
+    ws = FakeWSManager()
+    result = asyncio.run(asyncio.wait_for(bridge.launch_mas_interactive(
+        "run", {}, answer, ws_manager=ws, log_dir=str(tmp_path / "logs"), event_channel=True
+    ), timeout=10))
+
+    assert result["success"]
+    completed = [(m["tag_type"], m["data"]) for m in ws.messages if m.get("stream_complete")]
+    assert completed == [
+        ("AGENT", {"content": "text with <<<END_AGENT>>> inside"}),
+        ("USER_INPUT", {"prompt": "Target?", "value": None}),
+        ("SYSTEM", {"message": "got Vault"}),
+    ]
+
+
+def test_recursion_limit_cut_between_chunks(tmp_path, monkeypatch):
+    write_fake_mas(tmp_path, monkeypatch, '''
+        import sys, time
+        def emit(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            time.sleep(0.05)
+        emit('<<<SYSTEM>>>{"message": "before"}<<<END_SYSTEM>>>\\nboom GRAPH_RECURSION')
+        emit('_LIMIT<<<AGENT>>>{"content": "after"}<<<END_AGENT>>>\\n')
+        emit('<<<AGENT>>>{"content": "later"}<<<END_AGENT>>>\\n')
+    ''')
+
+    async def no_input(prompt):
+        return None
+
+    ws = FakeWSManager()
+    result = asyncio.run(bridge.launch_mas_interactive(
+        "run", {}, no_input, ws_manager=ws, log_dir=str(tmp_path / "logs")
+    ))
+
+    assert result["success"]
+    tag_types = [m.get("tag_type") for m in ws.messages if m.get("stream_complete")]
+    assert tag_types == ["SYSTEM"]
+    assert "GRAPH_RECURSION_LIMIT" in result["log"].text()